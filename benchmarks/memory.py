@@ -0,0 +1,173 @@
+"""
+Peak-memory benchmarks for the stages of the pro forma lookup and the
+Developer model, run on synthetic parcels (see benchmarks.synthetic).
+
+Each stage records the peak of the memory traced by tracemalloc (which
+includes NumPy and pandas buffers) above the memory held when the stage
+started, the memory the stage leaves behind, and the process peak RSS
+after the stage.  The prediction of SqFtProForma.estimate_memory is
+recorded next to the measured lookup peaks::
+
+    python -m benchmarks.memory --sizes 100k 1M --output memory.json
+
+"""
+
+import argparse
+import contextlib
+import gc
+import io
+import json
+import sys
+import time
+import tracemalloc
+from collections import OrderedDict
+
+import pandas as pd
+
+from benchmarks import synthetic
+from benchmarks.run import metadata, seeded
+from developer import develop
+from developer import sqftproforma as sqpf
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+def peak_rss():
+    """
+    Peak resident set size of the process in bytes, or None if it cannot
+    be measured on this platform.
+    """
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+class StageMemory(object):
+    """
+    Record the memory used by a sequence of stages.  tracemalloc must be
+    tracing while stages run.
+    """
+
+    def __init__(self):
+        self.stages = []
+
+    @contextlib.contextmanager
+    def stage(self, name, **info):
+        gc.collect()
+        tracemalloc.reset_peak()
+        start = tracemalloc.get_traced_memory()[0]
+        t = time.perf_counter()
+        yield
+        seconds = time.perf_counter() - t
+        current, peak = tracemalloc.get_traced_memory()
+        record = {'stage': name,
+                  'seconds': seconds,
+                  'tracemalloc_peak': peak - start,
+                  'tracemalloc_retained': current - start,
+                  'peak_rss': peak_rss()}
+        record.update(info)
+        self.stages.append(record)
+
+
+def profile(n, form='residential', seed=0, log=print):
+    """
+    Run the stages of a lookup of one form, a lookup of all forms and a
+    pick on n synthetic parcels, recording memory for each stage.
+
+    Parameters
+    ----------
+    n : int
+        Number of parcels
+    form : str, optional
+        Form whose lookup is broken down into its stages
+    seed : int, optional
+        Seed for the synthetic parcels
+    log : function, optional
+        Called with a progress message after each stage
+
+    Returns
+    -------
+    stages : list of dict
+    """
+    df = synthetic.parcels(n, seed)
+    mem = StageMemory()
+
+    tracemalloc.start()
+    try:
+        with mem.stage('reference_build'):
+            pf = sqpf.SqFtProForma.from_defaults()
+
+        # the stages of SqFtProForma.lookup for a single form
+        lookups = []
+        for parking_config in pf.parking_configs:
+            with mem.stage('lookup_parking_cfg', form=form,
+                           parking_config=parking_config):
+                lookups.append(pf._lookup_parking_cfg(
+                    form, parking_config, df, None, None, None, None))
+        with mem.stage('concat_max_profit_parking', form=form):
+            result = pf._max_profit_parking(pd.concat(lookups))
+        del lookups, result
+
+        # estimate_memory is missing from versions before it was added
+        estimate = getattr(pf, 'estimate_memory', lambda *args: None)
+        with mem.stage('lookup', form=form, estimate=estimate(n, form)):
+            pf.lookup(form, df)
+
+        with mem.stage('lookup_all_forms', estimate=estimate(n)):
+            feasibility = OrderedDict((f, pf.lookup(f, df))
+                                      for f in pf.forms_to_test)
+
+        with mem.stage('developer_construction'):
+            dev = develop.Developer(
+                feasibility, list(feasibility.keys()), max(n // 100, 1),
+                df.parcel_size, df.ave_unit_size, df.current_units)
+
+        with mem.stage('keep_form_with_max_profit'):
+            dev.keep_form_with_max_profit(dev.forms)
+
+        with mem.stage('pick'):
+            with contextlib.redirect_stdout(io.StringIO()):
+                seeded(dev.pick)
+    finally:
+        tracemalloc.stop()
+
+    for record in mem.stages:
+        log('{:<28} {:>10} {:10.1f} MB {:10.1f} MB'.format(
+            record['stage'], record.get('parking_config', ''),
+            record['tracemalloc_peak'] / 1e6,
+            (record.get('estimate') or float('nan')) / 1e6))
+    return mem.stages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', nargs='+', default=['10k', '100k'],
+                        help='problem sizes: ' + ', '.join(synthetic.SIZES) +
+                        ' or a number of parcels (default: 10k 100k)')
+    parser.add_argument('--form', default='residential',
+                        help='form whose lookup is broken down into stages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this JSON file')
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        n = synthetic.parse_size(size)
+        print('{} parcels: stage, peak traced memory, estimate'.format(n))
+        for record in profile(n, args.form, args.seed):
+            record.update({'size': size, 'n_parcels': n})
+            results.append(record)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'metadata': metadata(), 'results': results}, f,
+                      indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
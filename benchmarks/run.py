@@ -0,0 +1,386 @@
+"""
+Benchmark suite for the pro forma lookup, form competition and proposal
+selection, run on synthetic parcels (see benchmarks.synthetic).
+
+Results are written as JSON so that runs on different commits can be
+compared::
+
+    python -m benchmarks.run --sizes 10k 100k --output before.json
+    git checkout my-branch
+    python -m benchmarks.run --sizes 10k 100k --output after.json \\
+        --compare before.json
+
+The suite also runs against commits that predate it, or predate some of
+the APIs it covers: check the old commit out in a separate worktree and
+run the suite from there with this tree on the path.  Benchmarks of APIs
+that the code under test does not have are skipped::
+
+    git worktree add ../developer-old <commit>
+    cd ../developer-old
+    PYTHONPATH=/path/to/this/tree python -m benchmarks.run \\
+        --output before.json
+
+"""
+
+import argparse
+import contextlib
+import datetime
+import inspect
+import io
+import json
+import platform
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from developer import develop
+from developer import proposal_select
+from developer import sqftproforma as sqpf
+
+BENCHMARKS = OrderedDict()
+
+
+class Unsupported(Exception):
+    """
+    Raised by a benchmark whose API is missing from the version of the
+    developer package under test
+    """
+
+
+def require(obj, name):
+    """Raise Unsupported if obj has no attribute name"""
+    if not hasattr(obj, name):
+        raise Unsupported('{} has no attribute {}'.format(
+            getattr(obj, '__name__', type(obj).__name__), name))
+
+
+def seeded(func, *args):
+    """
+    Call a selection function or pick() with a fixed random seed, passing
+    rng=0 where the function supports it and seeding NumPy's global random
+    state otherwise
+    """
+    if 'rng' in inspect.signature(func).parameters:
+        return func(*args, rng=0)
+    np.random.seed(0)
+    return func(*args)
+
+
+def benchmark(name):
+    """
+    Register a benchmark.  The decorated function takes a Context and
+    returns a function without arguments, which is what gets timed, so
+    that setup is not included in the timings.
+    """
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+class Context(object):
+    """
+    Inputs for one problem size.  Parcels and feasibility tables are built
+    on first use and shared by all benchmarks of that size.
+
+    Parameters
+    ----------
+    n : int
+        Number of parcels
+    seed : int, optional
+        Seed for the synthetic parcels
+    """
+
+    def __init__(self, n, seed=0):
+        self.n = n
+        self.seed = seed
+        self._cache = {}
+
+    def _cached(self, key, func):
+        if key not in self._cache:
+            self._cache[key] = func()
+        return self._cache[key]
+
+    @property
+    def parcels(self):
+        return self._cached(
+            'parcels', lambda: synthetic.parcels(self.n, self.seed))
+
+    @property
+    def proforma(self):
+        return self._cached('proforma', sqpf.SqFtProForma.from_defaults)
+
+    @property
+    def feasibility(self):
+        """Lookup results for every form to test, one row per parcel"""
+        pf = self.proforma
+        return self._cached('feasibility', lambda: OrderedDict(
+            (form, pf.lookup(form, self.parcels))
+            for form in pf.forms_to_test))
+
+    @property
+    def long_feasibility(self):
+        """Residential lookup keeping three proposals per parcel"""
+        def build():
+            pf = sqpf.SqFtProForma.from_defaults()
+            pf.proposals_to_keep = 3
+            return pf.lookup('residential', self.parcels)
+        return self._cached('long_feasibility', build)
+
+    @property
+    def target_units(self):
+        return max(self.n // 100, 1)
+
+    def developer(self, keep_suboptimal=False, **kwargs):
+        """Return a new Developer on the cached feasibility tables"""
+        df = self.parcels
+        if keep_suboptimal:
+            feasibility = self.long_feasibility.copy()
+            forms = 'residential'
+        else:
+            feasibility = self.feasibility
+            forms = list(feasibility.keys())
+        return develop.Developer(
+            feasibility, forms, self.target_units, df.parcel_size,
+            df.ave_unit_size, df.current_units,
+            keep_suboptimal=keep_suboptimal, **kwargs)
+
+    def proposals(self, keep_suboptimal=False):
+        """Candidate proposals and probabilities as used by pick()"""
+        def build():
+            dev = self.developer(keep_suboptimal)
+            if hasattr(dev, '_prepare_proposals'):
+                return dev._prepare_proposals(None)
+            # the steps of pick() before _prepare_proposals was added
+            df = dev.feasibility if keep_suboptimal \
+                else dev._get_dataframe_of_buildings()
+            df = dev._calculate_net_units(
+                dev._remove_infeasible_buildings(df))
+            if keep_suboptimal:
+                df.index.name = 'parcel_id'
+                df = df.reset_index()
+            p, df = dev._calculate_probabilities(df, None)
+            return df, p
+        return self._cached(('proposals', keep_suboptimal), build)
+
+
+@benchmark('proforma_construction')
+def bench_proforma_construction(ctx):
+    return sqpf.SqFtProForma.from_defaults
+
+
+@benchmark('lookup_residential')
+def bench_lookup_residential(ctx):
+    pf, df = ctx.proforma, ctx.parcels
+    return lambda: pf.lookup('residential', df)
+
+
+@benchmark('lookup_all_forms')
+def bench_lookup_all_forms(ctx):
+    pf, df = ctx.proforma, ctx.parcels
+
+    def run():
+        for form in pf.forms_to_test:
+            pf.lookup(form, df)
+    return run
+
+
+@benchmark('lookup_proposals_to_keep')
+def bench_lookup_proposals_to_keep(ctx):
+    pf = sqpf.SqFtProForma.from_defaults()
+    pf.proposals_to_keep = 3
+    df = ctx.parcels
+    return lambda: pf.lookup('residential', df)
+
+
+@benchmark('lookup_grouped')
+def bench_lookup_grouped(ctx):
+    # residential lookup with 20 regional configurations in one pass
+    require(sqpf, 'GroupedProForma')
+    proformas = OrderedDict()
+    for i in range(20):
+        cfg = sqpf.SqFtProForma.get_defaults()
+        cfg['cap_rate'] = .04 + .001 * i
+        cfg['costs'] = {use: [c * (.8 + .02 * i) for c in costs]
+                        for use, costs in cfg['costs'].items()}
+        proformas[i] = sqpf.SqFtProForma(**cfg)
+    pf = sqpf.GroupedProForma(proformas)
+    df = ctx.parcels.assign(proforma_id=np.arange(ctx.n) % 20)
+    return lambda: pf.lookup('residential', df)
+
+
+@benchmark('evaluate_single_parcel')
+def bench_evaluate_single_parcel(ctx):
+    # 1000 low-latency evaluations of one parcel for every form; the
+    # reference arrays are built before timing
+    pf = sqpf.SqFtProForma.from_defaults()
+    require(pf, 'evaluate')
+    record = ctx.parcels.iloc[0].to_dict()
+    pf.evaluate(record)
+
+    def run():
+        for _ in range(1000):
+            pf.evaluate(record)
+    return run
+
+
+@benchmark('keep_form_with_max_profit')
+def bench_keep_form_with_max_profit(ctx):
+    dev = ctx.developer()
+    return lambda: dev.keep_form_with_max_profit(dev.forms)
+
+
+@benchmark('pick_wide')
+def bench_pick_wide(ctx):
+    dev = ctx.developer()
+    return lambda: seeded(dev.pick)
+
+
+@benchmark('pick_keep_suboptimal')
+def bench_pick_keep_suboptimal(ctx):
+    dev = ctx.developer(keep_suboptimal=True)
+    return lambda: seeded(dev.pick)
+
+
+@benchmark('weighted_random_choice')
+def bench_weighted_random_choice(ctx):
+    df, p = ctx.proposals()
+    target = ctx.target_units
+    return lambda: seeded(proposal_select.weighted_random_choice, df, p,
+                          target)
+
+
+@benchmark('weighted_random_choice_multiparcel')
+def bench_weighted_random_choice_multiparcel(ctx):
+    df, p = ctx.proposals(keep_suboptimal=True)
+    target = ctx.target_units
+    return lambda: seeded(
+        proposal_select.weighted_random_choice_multiparcel, df, p, target)
+
+
+def run(names, sizes, repeat=3, seed=0, log=print):
+    """
+    Run benchmarks.
+
+    Parameters
+    ----------
+    names : list of strings
+        Names of registered benchmarks
+    sizes : list of strings
+        Problem sizes, named (e.g. "100k") or as a number of parcels
+    repeat : int, optional
+        Number of timed runs of each benchmark
+    seed : int, optional
+        Seed for the synthetic parcels
+    log : function, optional
+        Called with a progress message after each benchmark
+
+    Returns
+    -------
+    results : list of dict
+        Benchmarks of APIs that the code under test does not have are left
+        out
+    """
+    results = []
+    for size in sizes:
+        ctx = Context(synthetic.parse_size(size), seed)
+        for name in names:
+            times = []
+            try:
+                for _ in range(repeat):
+                    # silence the progress prints of lookup and pick
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        stmt = BENCHMARKS[name](ctx)
+                        start = time.perf_counter()
+                        stmt()
+                        times.append(time.perf_counter() - start)
+            except Unsupported as e:
+                log('{:<40} {:>6} skipped: {}'.format(name, size, e))
+                continue
+            results.append({'benchmark': name, 'size': size,
+                            'n_parcels': ctx.n, 'times': times,
+                            'min': min(times),
+                            'median': float(np.median(times))})
+            log('{:<40} {:>6} {:10.4f}s'.format(name, size, min(times)))
+    return results
+
+
+def metadata():
+    """Describe the environment and commit that results were taken on"""
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit,
+            'timestamp': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'machine': platform.machine(),
+            'platform': platform.platform()}
+
+
+def compare(baseline, results, log=print):
+    """
+    Print the ratio of the best times in results to those in baseline, for
+    the benchmarks and sizes that appear in both.
+    """
+    old = {(r['benchmark'], r['n_parcels']): r['min']
+           for r in baseline['results']}
+    log('{:<40} {:>6} {:>10} {:>10} {:>7}'.format(
+        'benchmark', 'size', 'baseline', 'current', 'ratio'))
+    for r in results:
+        key = (r['benchmark'], r['n_parcels'])
+        if key not in old:
+            continue
+        log('{:<40} {:>6} {:10.4f} {:10.4f} {:7.2f}'.format(
+            r['benchmark'], r['size'], old[key], r['min'],
+            r['min'] / old[key]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', nargs='+', default=['10k', '100k'],
+                        help='problem sizes: ' + ', '.join(synthetic.SIZES) +
+                        ' or a number of parcels (default: 10k 100k)')
+    parser.add_argument('--benchmarks', nargs='+', default=None,
+                        help='run only benchmarks whose name contains one '
+                        'of these strings')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write results to this JSON file')
+    parser.add_argument('--compare',
+                        help='JSON results file to compare against')
+    parser.add_argument('--list', action='store_true',
+                        help='list benchmarks and exit')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        for name in BENCHMARKS:
+            print(name)
+        return
+
+    names = [name for name in BENCHMARKS
+             if args.benchmarks is None or
+             any(s in name for s in args.benchmarks)]
+    results = run(names, args.sizes, args.repeat, args.seed)
+    output = {'metadata': metadata(), 'results': results}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(output, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
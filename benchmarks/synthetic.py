@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+# Named problem sizes for the benchmark suite
+SIZES = {'10k': 10000,
+         '100k': 100000,
+         '1M': 1000000,
+         '5M': 5000000}
+
+
+def parse_size(size):
+    """
+    Turn a named size like "100k" or an integer string into a number of
+    parcels.
+    """
+    if size in SIZES:
+        return SIZES[size]
+    return int(size)
+
+
+def parcels(n, seed=0):
+    """
+    Generate a synthetic, realistically distributed set of parcels to feed
+    the pro forma lookup and the Developer model.
+
+    Parcel sizes and land values are log-normal, rents follow a shared
+    location quality factor so that uses are correlated across parcels,
+    zoning is drawn from a small set of typical FAR and height limits
+    (with some parcels missing a height limit), and a majority of parcels
+    already carry residential units.
+
+    Parameters
+    ----------
+    n : int
+        Number of parcels
+    seed : int, optional
+        Seed for the random generator, so that runs on different commits
+        use identical inputs
+
+    Returns
+    -------
+    df : DataFrame
+        Indexed by parcel_id, with rent columns for each use and the
+        land_cost, parcel_size, max_far, max_height, ave_unit_size and
+        current_units columns
+    """
+    rng = np.random.default_rng(seed)
+
+    parcel_size = np.exp(rng.normal(np.log(7000), 1.0, n)).clip(500, 2e6)
+    quality = np.exp(rng.normal(0, .25, n))
+
+    def rent(median, sigma=.1):
+        return median * quality * np.exp(rng.normal(0, sigma, n))
+
+    land_value_per_sqft = np.exp(rng.normal(np.log(250), .8, n))
+
+    max_far = rng.choice([.5, 1., 1.5, 2., 3., 4., 6., 10.], n,
+                         p=[.25, .25, .15, .12, .1, .07, .04, .02])
+    max_height = rng.choice([35., 45., 65., 85., 120., 240.], n,
+                            p=[.35, .25, .15, .12, .08, .05])
+    max_height[rng.random(n) < .05] = np.nan
+
+    current_units = np.where(rng.random(n) < .6,
+                             rng.poisson(parcel_size / 3000.), 0)
+
+    return pd.DataFrame(
+        {'residential': rent(35.),
+         'office': rent(22.),
+         'retail': rent(20.),
+         'industrial': rent(12.),
+         'land_cost': parcel_size * land_value_per_sqft,
+         'parcel_size': parcel_size,
+         'max_far': max_far,
+         'max_height': max_height,
+         'ave_unit_size': np.exp(rng.normal(np.log(900), .2, n)).clip(400),
+         'current_units': current_units},
+        index=pd.Index(np.arange(1, n + 1), name='parcel_id'))
@@ -0,0 +1,333 @@
+"""
+Command line runner for the pro forma feasibility of large parcel files.
+
+Streams a parcel table from Parquet or CSV in chunks, runs the lookup of
+every form to test in parallel worker processes and writes the results
+partitioned by form, one file per chunk::
+
+    developer-feasibility --config proforma.yaml --parcels parcels.parquet \\
+        --output feasibility --chunk-size 200000 --workers 4
+
+    feasibility/
+        form=residential/part-00000.parquet
+        form=residential/part-00001.parquet
+        form=office/part-00000.parquet
+        ...
+        _markers/residential-00000.json
+        _run.json
+        _stats.json
+
+A marker is written once the output of a chunk and form is complete, so an
+interrupted run picks up where it stopped when started again with the same
+arguments.  Parquet output is in the long format of
+developer.feasibility.to_parquet and can be read back with
+read_feasibility or Developer.from_parquet.  Output is written as CSV if
+pyarrow is not installed.
+
+"""
+
+import argparse
+import concurrent.futures
+import json
+import glob
+import os
+import shutil
+import sys
+import time
+
+import pandas as pd
+
+from developer import sqftproforma as sqpf
+from developer.feasibility import to_parquet
+from developer.stats import Stats
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+def read_chunks(path, chunk_size, index_col=None):
+    """
+    Read a parcel table in chunks.
+
+    Parameters
+    ----------
+    path : str
+        Parquet file (read by row group batches) or CSV file
+    chunk_size : int
+        Number of parcels per chunk
+    index_col : str, optional
+        Column to use as the parcel index
+
+    Returns
+    -------
+    generator of DataFrame
+    """
+    if path.endswith(('.parquet', '.pq')):
+        if pq is None:
+            raise ImportError('pyarrow is required to read Parquet files')
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            df = batch.to_pandas()
+            yield df.set_index(index_col) if index_col else df
+    else:
+        for df in pd.read_csv(path, chunksize=chunk_size,
+                              index_col=index_col):
+            yield df
+
+
+def part_path(output, form, chunk, fmt):
+    return os.path.join(output, 'form={}'.format(form),
+                        'part-{:05d}.{}'.format(chunk, fmt))
+
+
+def marker_path(output, form, chunk):
+    return os.path.join(output, '_markers',
+                        '{}-{:05d}.json'.format(form, chunk))
+
+
+def write_part(df, output, form, chunk, fmt):
+    """
+    Write the lookup results of one form and chunk.  The file is written
+    under a temporary name and renamed, so a part either exists whole or
+    not at all.
+    """
+    if fmt == 'parquet':
+        to_parquet({form: df}, output, part=chunk)
+        return
+    path = part_path(output, form, chunk, fmt)
+    df.to_csv(path + '.tmp')
+    os.replace(path + '.tmp', path)
+
+
+# The pro forma of a worker process, created once by _init_worker
+_worker_pf = None
+
+
+def _init_worker(yaml_str):
+    global _worker_pf
+    _worker_pf = sqpf.SqFtProForma.from_yaml(yaml_str)
+
+
+def _run_task(form, chunk, df, output, fmt):
+    """
+    Run the lookup of one form on one chunk of parcels and write the
+    result and its marker.  Returns the marker record.
+    """
+    pf = _worker_pf
+    pf.stats = Stats()
+    start = time.perf_counter()
+    result = pf.lookup(form, df)
+    if len(result):
+        with pf.stats.timer('write'):
+            write_part(result, output, form, chunk, fmt)
+    elif os.path.exists(part_path(output, form, chunk, fmt)):
+        # no part is written for chunks without feasible proposals, and a
+        # part left by an earlier run of the chunk is removed
+        os.remove(part_path(output, form, chunk, fmt))
+
+    record = {'form': form, 'chunk': chunk, 'parcels': len(df),
+              'rows': len(result), 'seconds': time.perf_counter() - start,
+              'stats': pf.stats.to_dict()}
+    with open(marker_path(output, form, chunk), 'w') as f:
+        json.dump(record, f)
+    return record
+
+
+def _check_run(output, run_info, resume):
+    """
+    Write the description of the run, or check that an existing output
+    directory was produced by the same run before resuming it.
+    """
+    path = os.path.join(output, '_run.json')
+    if resume and os.path.exists(path):
+        with open(path) as f:
+            previous = json.load(f)
+        if previous != run_info:
+            raise ValueError(
+                'Output directory {} was written by a run with different '
+                'settings; use a new directory or --no-resume'.format(output))
+    with open(path, 'w') as f:
+        json.dump(run_info, f, indent=2)
+
+
+def clear_output(output):
+    """
+    Remove the parts and markers of an earlier run from an output
+    directory, so that none of them are mixed with the results of a new
+    run.  Other files in the directory are left alone.
+    """
+    for path in glob.glob(os.path.join(output, 'form=*')) + \
+            [os.path.join(output, '_markers')]:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+
+def stats_timed(stats, name, iterable):
+    """Yield from iterable, adding the time spent in next() to stats"""
+    iterator = iter(iterable)
+    while True:
+        with stats.timer(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def run(config, parcels, output, forms=None, chunk_size=100000, workers=1,
+        fmt=None, index_col=None, resume=True, log=print):
+    """
+    Run the pro forma lookup of a parcel file chunk by chunk and write the
+    results partitioned by form.
+
+    Parameters
+    ----------
+    config : str
+        Pro forma YAML file
+    parcels : str
+        Parcel file, Parquet or CSV
+    output : str
+        Output directory
+    forms : list of str, optional
+        Forms to look up.  Defaults to the forms_to_test of the pro forma.
+    chunk_size : int, optional
+        Number of parcels per chunk
+    workers : int, optional
+        Number of worker processes.  With 1, lookups run in this process.
+    fmt : str, optional
+        "parquet" or "csv".  Defaults to Parquet if pyarrow is installed.
+    index_col : str, optional
+        Column of the parcel file to use as the parcel index
+    resume : bool, optional
+        Skip chunks whose output is complete from an earlier run with the
+        same settings and the same parcel file (size and modification
+        time); a ValueError is raised if they differ.  If False, the parts
+        and markers of an earlier run are removed first.
+    log : function, optional
+        Called with progress messages
+
+    Returns
+    -------
+    stats : Stats
+        Timings and counts accumulated over all chunks and forms
+    """
+    if fmt is None:
+        fmt = 'parquet' if pq is not None else 'csv'
+    if fmt == 'parquet' and pq is None:
+        raise ImportError('pyarrow is required to write Parquet output')
+    if fmt not in ('parquet', 'csv'):
+        raise ValueError('fmt must be "parquet" or "csv"')
+
+    with open(config) as f:
+        yaml_str = f.read()
+    pf = sqpf.SqFtProForma.from_yaml(yaml_str)
+    if forms is None:
+        forms = pf.forms_to_test
+
+    if not resume:
+        clear_output(output)
+    for form in forms:
+        os.makedirs(os.path.dirname(part_path(output, form, 0, fmt)),
+                    exist_ok=True)
+    os.makedirs(os.path.join(output, '_markers'), exist_ok=True)
+    # the size and modification time identify the contents of the parcel
+    # file, so that a file regenerated at the same path is not resumed
+    parcels_stat = os.stat(parcels)
+    _check_run(output, {'config': yaml_str,
+                        'parcels': os.path.abspath(parcels),
+                        'parcels_size': parcels_stat.st_size,
+                        'parcels_mtime': parcels_stat.st_mtime_ns,
+                        'forms': list(forms), 'chunk_size': chunk_size,
+                        'format': fmt, 'index_col': index_col}, resume)
+
+    stats = Stats()
+    done = {'tasks': 0, 'skipped': 0, 'parcels': 0}
+    start = time.perf_counter()
+
+    def finish(record):
+        for name, seconds in record['stats']['timings'].items():
+            stats.add_time(name, seconds)
+        for name, n in record['stats']['counts'].items():
+            stats.count(name, n)
+        stats.count('rows.' + record['form'], record['rows'])
+        done['tasks'] += 1
+        log('chunk {:>5} {:<15} {:>9} parcels {:>9} feasible {:8.2f}s '
+            '({:.0f}s elapsed)'.format(
+                record['chunk'], record['form'], record['parcels'],
+                record['rows'], record['seconds'],
+                time.perf_counter() - start))
+
+    if workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            workers, initializer=_init_worker, initargs=(yaml_str,))
+    else:
+        _init_worker(yaml_str)
+        executor = None
+    pending = set()
+
+    try:
+        chunks = read_chunks(parcels, chunk_size, index_col)
+        for chunk, df in enumerate(stats_timed(stats, 'read', chunks)):
+            done['parcels'] += len(df)
+            for form in forms:
+                if resume and os.path.exists(
+                        marker_path(output, form, chunk)):
+                    done['skipped'] += 1
+                    continue
+                if executor is None:
+                    finish(_run_task(form, chunk, df, output, fmt))
+                    continue
+                pending.add(executor.submit(
+                    _run_task, form, chunk, df, output, fmt))
+
+            # bound the number of chunks held in memory
+            while len(pending) > 2 * workers:
+                completed, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in completed:
+                    finish(future.result())
+
+        for future in concurrent.futures.as_completed(pending):
+            finish(future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    stats.add_time('total', time.perf_counter() - start)
+    stats.count('parcels', done['parcels'])
+    with open(os.path.join(output, '_stats.json'), 'w') as f:
+        json.dump(stats.to_dict(), f, indent=2)
+    log('{} parcels, {} lookups run, {} skipped as already complete'.format(
+        done['parcels'], done['tasks'], done['skipped']))
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Run the pro forma feasibility of a parcel file')
+    parser.add_argument('--config', required=True,
+                        help='pro forma YAML configuration')
+    parser.add_argument('--parcels', required=True,
+                        help='parcel table, Parquet or CSV')
+    parser.add_argument('--output', required=True, help='output directory')
+    parser.add_argument('--forms', nargs='+',
+                        help='forms to look up (default: forms_to_test)')
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--format', choices=['parquet', 'csv'],
+                        help='output format (default: parquet if pyarrow '
+                        'is installed)')
+    parser.add_argument('--index-col', help='parcel id column')
+    parser.add_argument('--no-resume', action='store_true',
+                        help='recompute chunks completed by an earlier run')
+    args = parser.parse_args(argv)
+
+    stats = run(args.config, args.parcels, args.output, args.forms,
+                args.chunk_size, args.workers, args.format, args.index_col,
+                not args.no_resume)
+    print(stats)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
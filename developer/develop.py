@@ -1,11 +1,16 @@
 from __future__ import print_function, division, absolute_import
 
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 import pandas as pd
 
 import developer.utils as utils
 from developer import proposal_select
+from developer.feasibility import FeasibilityCube, FeasibilityStore, \
+    read_feasibility
+from developer.stats import NULL_STATS
 from numbers import Number
 
 logger = logging.getLogger(__name__)
@@ -16,11 +21,13 @@ class Developer(object):
     Pass the dataframe that is returned by feasibility here
 
     Can also be a dictionary where keys are building forms and values are
-    the individual data frames returned by the proforma lookup routine.
+    the individual data frames returned by the proforma lookup routine, or
+    a FeasibilityCube as returned by SqFtProForma.lookup_all, or an on-disk
+    FeasibilityStore as returned by SqFtProForma.lookup_to_store.
 
     Parameters
     ----------
-    feasibility : DataFrame or dict
+    feasibility : DataFrame, dict, FeasibilityCube or FeasibilityStore
         Results from SqftProForma lookup method
     forms : string or list
         One or more of the building forms from the pro forma specification -
@@ -77,6 +84,33 @@ class Developer(object):
         consideration of feasible proposals for a given parcel that may not be
         the optimal form and which may not be the optimal proposal within a
         given form.
+    partition_col: optional, str
+        Name of a column of the feasibility table (e.g. "form", or a
+        submarket or county column passed through the pro forma) by which
+        demand is partitioned.  If this is set and target_units is a
+        DataFrame indexed by the values of this column, the target of each
+        partition is met independently, from that partition's proposals
+        only and with probabilities normalized within the partition.
+    mask_after_build: optional, bool
+        If True (and drop_after_build is True), parcels chosen for
+        development are marked as unavailable in the parcel_available mask
+        instead of being dropped from the feasibility table, so that the
+        table is not rebuilt after every pick and can be reused by later
+        picks in the same year or in later years.  Parcels are always
+        masked rather than dropped when keep_suboptimal is True.
+    priority_index: optional, bool
+        If True, the feasible proposals, their probabilities and a
+        profit-ordered PriorityIndex over them are prepared on the first
+        pick and reused by follow-up picks on the same feasibility table
+        (e.g. one pick per building type within a year), so that later
+        picks only skip the parcels that have been built instead of
+        re-filtering and re-scoring the whole table.  Built parcels are
+        masked rather than dropped, as with mask_after_build.
+    stats: optional, developer.stats.Stats
+        Instrumentation object that records the time spent in each stage
+        of pick() (including a custom_selection_func) and the number of
+        rows dropped at each filter, under "pick.*" names.  By default
+        nothing is recorded.
 
     """
 
@@ -85,7 +119,9 @@ class Developer(object):
                  year=None, bldg_sqft_per_job=400.0,
                  min_unit_size=400, max_parcel_size=200000,
                  drop_after_build=True, residential=True,
-                 num_units_to_build=None, keep_suboptimal=False):
+                 num_units_to_build=None, keep_suboptimal=False,
+                 partition_col=None, mask_after_build=False,
+                 priority_index=False, stats=None):
 
         if isinstance(feasibility, dict):
             feasibility = pd.concat(feasibility.values(),
@@ -104,12 +140,27 @@ class Developer(object):
         self.residential = residential
         self.num_units_to_build = num_units_to_build
         self.keep_suboptimal = keep_suboptimal
+        self.partition_col = partition_col
+        self.mask_after_build = mask_after_build
+        self.priority_index = priority_index
+        self.stats = NULL_STATS if stats is None else stats
+
+        # parcels are numbered once, in the order of the parcel attribute
+        # Series, and keep their position for the life of the model; built
+        # and dropped parcels are tombstoned in _parcel_available
+        self._parcels = pd.Index(pd.unique(parcel_size.index),
+                                 name='parcel_id')
+        self._parcel_available = np.ones(len(self._parcels), dtype='bool')
+        self._availability_of = None
+        self._parcel_attributes_cache = None
+        self._proposal_cache = None
 
     @classmethod
     def from_yaml(cls, feasibility, forms, target_units,
                   parcel_size, ave_unit_size, current_units,
                   year=None, yaml_str=None, str_or_buffer=None,
-                  keep_suboptimal=False):
+                  keep_suboptimal=False, partition_col=None,
+                  mask_after_build=False, priority_index=False):
         """
         Parameters
         ----------
@@ -124,6 +175,9 @@ class Developer(object):
         """
         cfg = utils.yaml_to_dict(yaml_str, str_or_buffer)
         keep_suboptimal = cfg.get('keep_suboptimal', keep_suboptimal)
+        partition_col = cfg.get('partition_col', partition_col)
+        mask_after_build = cfg.get('mask_after_build', mask_after_build)
+        priority_index = cfg.get('priority_index', priority_index)
 
         model = cls(
             feasibility, forms, target_units,
@@ -131,12 +185,43 @@ class Developer(object):
             year, cfg['bldg_sqft_per_job'],
             cfg['min_unit_size'], cfg['max_parcel_size'],
             cfg['drop_after_build'], cfg['residential'],
-            keep_suboptimal=keep_suboptimal
+            keep_suboptimal=keep_suboptimal, partition_col=partition_col,
+            mask_after_build=mask_after_build, priority_index=priority_index
         )
 
         logger.debug('loaded Developer model from YAML')
         return model
 
+    @classmethod
+    def from_parquet(cls, path, forms, target_units, parcel_size,
+                     ave_unit_size, current_units, filters=None, **kwargs):
+        """
+        Create a Developer from feasibility results saved with
+        developer.feasibility.to_parquet or the developer-feasibility
+        command.  Only the forms in forms and the proposals passing filters
+        are read, rather than the whole table.
+
+        Parameters
+        ----------
+        path : str
+            Directory of the feasibility dataset
+        filters : list, optional
+            Predicates pushed down to the Parquet reader, e.g.
+            ``[('max_profit', '>', 0)]``; see
+            developer.feasibility.read_feasibility
+        **kwargs
+            Other arguments of the Developer model
+
+        Returns
+        -------
+        Developer object
+        """
+        feasibility = read_feasibility(
+            path, forms=forms, filters=filters,
+            long=kwargs.get('keep_suboptimal', False))
+        return cls(feasibility, forms, target_units, parcel_size,
+                   ave_unit_size, current_units, **kwargs)
+
     @property
     def to_dict(self):
         """
@@ -145,7 +230,8 @@ class Developer(object):
         """
         attributes = ['bldg_sqft_per_job',
                       'min_unit_size', 'max_parcel_size',
-                      'drop_after_build', 'residential', 'keep_suboptimal']
+                      'drop_after_build', 'residential', 'keep_suboptimal',
+                      'partition_col', 'mask_after_build', 'priority_index']
 
         results = {}
         for attribute in attributes:
@@ -174,7 +260,141 @@ class Developer(object):
         logger.debug('serializing Developer model to YAML')
         return utils.convert_to_yaml(self.to_dict, str_or_buffer)
 
-    def pick(self, profit_to_prob_func=None, custom_selection_func=None):
+    @property
+    def parcels(self):
+        """
+        Index of the parcels known to the model, in the order used by the
+        parcel_available mask: the parcels of parcel_size, followed by any
+        parcels of the feasibility table that are not in parcel_size.
+        """
+        self._update_availability()
+        return self._parcels
+
+    @property
+    def parcel_available(self):
+        """
+        Boolean array over self.parcels of parcels that are still available
+        for development.  Bits may be flipped directly by the caller, e.g.
+        for parcels consumed by other models.  Parcels that are marked as
+        unavailable stay unavailable when self.feasibility is replaced.
+        """
+        self._update_availability()
+        return self._parcel_available
+
+    @property
+    def proposal_available(self):
+        """
+        Boolean array over the rows of self.feasibility of proposals that
+        are still available for development.  Reset whenever
+        self.feasibility is replaced.
+        """
+        self._update_availability()
+        return self._proposal_available
+
+    @property
+    def available(self):
+        """
+        Boolean array over the rows of self.feasibility of proposals that
+        are available, and whose parcel is available, for development.
+        """
+        self._update_availability()
+        return (self._proposal_available &
+                self._parcel_available[self._row_codes])
+
+    def mark_unavailable(self, parcel_ids):
+        """
+        Mark parcels as unavailable for development.  Later picks skip all
+        proposals on these parcels.
+
+        Parameters
+        ----------
+        parcel_ids : array-like
+            Parcel identifiers.  Parcels that are not in the feasibility
+            table are ignored.
+
+        Returns
+        -------
+        None
+        """
+        positions = self.parcels.get_indexer(np.asarray(parcel_ids))
+        self._parcel_available[positions[positions >= 0]] = False
+
+    def _update_availability(self):
+        """
+        Map the rows of the current feasibility table to parcel positions,
+        if this has not been done yet or if self.feasibility has been
+        replaced by the caller.  Parcels of the table that are not known
+        yet are appended to self.parcels.
+        """
+        if self._availability_of is self.feasibility:
+            return
+
+        index = self.feasibility.index
+        codes = self._parcels.get_indexer(index)
+        if (codes < 0).any():
+            new = pd.Index(pd.unique(index[codes < 0]), name='parcel_id')
+            self._parcels = self._parcels.append(new)
+            self._parcel_available = np.concatenate(
+                [self._parcel_available, np.ones(len(new), dtype='bool')])
+            codes = self._parcels.get_indexer(index)
+
+        self._row_codes = codes.astype('int32')
+        self._parcel_present = np.bincount(
+            codes, minlength=len(self._parcels)) > 0
+        self._proposal_available = np.ones(len(codes), dtype='bool')
+        self._availability_of = self.feasibility
+
+    def _parcel_attributes(self):
+        """
+        Return ave_unit_size (clamped to min_unit_size), parcel_size and
+        current_units as arrays aligned with self.parcels.  The arrays are
+        built once and reused across picks until one of the parcel Series
+        is replaced or parcels are added to self.parcels.
+
+        Returns
+        -------
+        attributes : dict
+            Keys are attribute names and values are ndarrays
+        """
+        sources = (self.parcels, self.ave_unit_size, self.parcel_size,
+                   self.current_units)
+        # self.parcels is only replaced when parcels are appended to it
+        cache = self._parcel_attributes_cache
+        if (cache is not None and cache[2] == self.min_unit_size and
+                all(a is b for a, b in zip(cache[0], sources))):
+            return cache[1]
+
+        def gather(s):
+            s = s[~s.index.duplicated()]
+            return s.reindex(self.parcels).values.astype('float')
+
+        ave_unit_size = gather(self.ave_unit_size)
+        ave_unit_size[ave_unit_size < self.min_unit_size] = \
+            self.min_unit_size
+        attributes = {'ave_unit_size': ave_unit_size,
+                      'parcel_size': gather(self.parcel_size),
+                      'current_units': gather(self.current_units)}
+
+        self._parcel_attributes_cache = (sources, attributes,
+                                         self.min_unit_size)
+        return attributes
+
+    def _available_feasibility(self):
+        """
+        Return the rows of self.feasibility that are available for
+        development.  The table itself is returned if no rows are masked.
+        """
+        available = self.available
+        if available.all():
+            return self.feasibility
+        rows = np.flatnonzero(available)
+        if isinstance(self.feasibility, (FeasibilityCube, FeasibilityStore)):
+            return self.feasibility.take(rows)
+        return self.feasibility.iloc[rows]
+
+    def pick(self, profit_to_prob_func=None, custom_selection_func=None,
+             rng=None, n_jobs=1, selection_method='weighted_random',
+             sampler=None):
         """
         Choose the buildings from the list that are feasible to build in
         order to match the specified demand.
@@ -192,6 +412,29 @@ class Developer(object):
             development after probabilities are calculated. Must have
             parameters (self, df, p) and return a numpy array of buildings to
             build (i.e. df.index.values)
+        rng : Generator, SeedSequence or int, optional
+            Random Generator or seed used to select buildings.  Passing a
+            seed makes the pick reproducible without touching NumPy's global
+            random state, so picks can run in parallel.  If None, the seed
+            is drawn from the global random state.
+        n_jobs : int, optional
+            Number of threads used to select buildings when demand is
+            partitioned (see partition_col).  Each partition draws from its
+            own random stream, so results do not depend on n_jobs.
+        selection_method : str, optional
+            Name of a built-in strategy from proposal_select.SELECTION_METHODS
+            used when no custom_selection_func is passed.  Either
+            "weighted_random" (the default) to select buildings at random,
+            weighted by probability, or "top_profit" to deterministically
+            build the most profitable proposals first until demand is met.
+        sampler : ProposalSampler, optional
+            Sampler returned by build_sampler().  If passed, the proposals
+            and probabilities it was built from are reused instead of being
+            recomputed, and buildings are drawn from it.  Parcels that are
+            no longer available are skipped.  Not used for partitioned
+            targets or with a custom_selection_func.  See also the
+            priority_index option, which prepares and reuses a sampler
+            automatically.
 
         Returns
         -------
@@ -200,29 +443,308 @@ class Developer(object):
             DataFrame of buildings to add.  These buildings are rows from the
             DataFrame that is returned from feasibility.
         """
+        parcels = None
+        index = None
+        if sampler is not None:
+            df, p, parcels = sampler.df, sampler.p, sampler.parcels
+        elif self.priority_index:
+            cache = self._cached_proposals(profit_to_prob_func)
+            if cache is None:
+                return
+            df, p, sampler, index = cache
+            if selection_method != 'weighted_random':
+                sampler = None
+            if selection_method != 'top_profit':
+                index = None
+            if (custom_selection_func is not None or
+                    (sampler is None and index is None) or
+                    (self.partition_col is not None and
+                     isinstance(self.target_units, pd.DataFrame))):
+                sampler = index = None
+                available = self._parcel_available[df.parcel_code.values]
+                df, p = df[available], p[available]
+                if len(df) == 0:
+                    print("WARNING THERE ARE NO FEASIBLE BUILDINGS TO "
+                          "CHOOSE FROM")
+                    return
+                # probabilities of the remaining proposals sum to one again
+                if p.sum() > 0:
+                    p = p / p.sum()
+        else:
+            df, p = self._prepare_proposals(profit_to_prob_func)
+            if df is None:
+                return
+
+        stats = self.stats
+
+        # Select proposals to build
+        with stats.timer('pick.select'):
+            build_idx = self._select_buildings(
+                df, p, custom_selection_func, rng, n_jobs, selection_method,
+                sampler, index)
+        stats.count('pick.sampled', len(build_idx))
+
+        # Drop or mask built buildings in self.feasibility if desired
+        with stats.timer('pick.drop_built'):
+            self._drop_built_buildings(df, build_idx, parcels)
+
+        # Prep DataFrame of new buildings
+        new_df = self._prepare_new_buildings(df, build_idx)
+        stats.count('pick.built', len(new_df))
+
+        return new_df
+
+    def pick_joint(self, target_job_spaces, current_job_spaces=None,
+                   profit_to_prob_func=None, rng=None):
+        """
+        Choose buildings to meet residential and non-residential demand in
+        a single pass, instead of running the model once with
+        residential=True and once with residential=False.  The feasibility
+        table is prepared once, forms compete across both kinds of demand,
+        and each parcel is built at most once.  The residential target is
+        self.target_units and self.current_units are the current
+        residential units; the residential attribute is ignored.
+
+        Parameters
+        ----------
+        target_job_spaces : int
+            The number of job spaces that need to be built
+        current_job_spaces : Series, optional
+            The current number of job spaces on each parcel, indexed by
+            parcel_id.  Used to compute net job spaces; parcels that are
+            missing are assumed to have none.
+        profit_to_prob_func: function, optional
+            As in pick()
+        rng : Generator, SeedSequence or int, optional
+            As in pick()
+
+        Returns
+        -------
+        None if there are no feasible buildings
+        new_buildings : dataframe
+            DataFrame of buildings to add, with net_residential_units and
+            net_job_spaces columns.
+        """
+        if (self.partition_col is not None and
+                isinstance(self.target_units, pd.DataFrame)):
+            raise ValueError("pick_joint does not support partitioned "
+                             "targets")
+
+        df, p = self._prepare_proposals(profit_to_prob_func, joint=True,
+                                        current_job_spaces=current_job_spaces)
+        if df is None:
+            return
+
+        if isinstance(self.target_units, pd.DataFrame):
+            target_units = self.target_units.target_units.sum()
+        else:
+            target_units = self.target_units
+
+        stats = self.stats
+        with stats.timer('pick.select'):
+            build_idx = proposal_select.weighted_random_joint_choice(
+                df, p, target_units, target_job_spaces, rng=rng,
+                multiparcel=self.keep_suboptimal)
+        stats.count('pick.sampled', len(build_idx))
+
+        with stats.timer('pick.drop_built'):
+            self._drop_built_buildings(df, build_idx)
+
+        new_df = self._prepare_new_buildings(df, build_idx)
+        stats.count('pick.built', len(new_df))
+
+        return new_df
+
+    def pick_replicates(self, n, seed=None, profit_to_prob_func=None,
+                        frequencies=False):
+        """
+        Run n replicates of the weighted random pick on the current
+        feasibility table, e.g. to get uncertainty bands.  The feasible
+        proposals and their probabilities are prepared once, and all
+        replicates are then selected together.  Replicate i selects the
+        same buildings as pick(rng=...) with the i-th Generator spawned from
+        seed.  Nothing is dropped from or masked in self.feasibility.
+
+        Parameters
+        ----------
+        n : int
+            Number of replicates
+        seed : None, int, SeedSequence or Generator, optional
+            Seed from which one random stream per replicate is spawned.  If
+            None, the seed is drawn from NumPy's global random state.
+        profit_to_prob_func: function, optional
+            As in pick()
+        frequencies : bool, optional
+            If True, return the share of replicates in which each parcel is
+            built rather than the selection matrix.
+
+        Returns
+        -------
+        None if there are no feasible buildings
+        df : DataFrame
+            DataFrame of candidate buildings, one row per proposal
+        selected : ndarray
+            Boolean array of shape (n, len(df)) of the proposals built in
+            each replicate
+        or, if frequencies is True:
+        frequencies : Series
+            Share of replicates in which each parcel is built, indexed by
+            parcel_id
+        """
+        if (self.partition_col is not None and
+                isinstance(self.target_units, pd.DataFrame)):
+            raise ValueError("pick_replicates does not support partitioned "
+                             "targets")
+
+        df, p = self._prepare_proposals(profit_to_prob_func)
+        if df is None:
+            return
+
+        if isinstance(self.target_units, pd.DataFrame):
+            target_units = self.target_units.target_units.sum()
+        else:
+            target_units = self.target_units
+
+        selected = proposal_select.weighted_random_replicates(
+            df, p, target_units, utils.spawn_rngs(seed, n),
+            multiparcel=self.keep_suboptimal)
+        df = df.drop('parcel_code', axis=1)
+
+        if not frequencies:
+            return df, selected
+
+        # at most one proposal per parcel is built in each replicate
+        parcel_ids = df.parcel_id.values if self.keep_suboptimal \
+            else df.index.values
+        codes, parcels = pd.factorize(parcel_ids)
+        counts = np.bincount(codes, weights=selected.sum(axis=0),
+                             minlength=len(parcels))
+        return pd.Series(counts / n, index=pd.Index(parcels,
+                                                    name='parcel_id'))
+
+    def _cached_proposals(self, profit_to_prob_func):
+        """
+        Helper method to pick() when priority_index is set. Returns the
+        feasible proposals, their probabilities, a ProposalSampler and a
+        PriorityIndex over them, prepared once and reused as long as the
+        feasibility table and the settings that the preparation depends on
+        do not change.
+
+        Returns
+        -------
+        None if there are no feasible buildings
+        cache : tuple
+            (df, p, sampler, index)
+        """
+        sources = (self.feasibility, profit_to_prob_func, self.ave_unit_size,
+                   self.parcel_size, self.current_units)
+        settings = (self.forms, self.residential, self.min_unit_size,
+                    self.max_parcel_size, self.bldg_sqft_per_job,
+                    self.keep_suboptimal)
+        cache = self._proposal_cache
+        if (cache is not None and cache[2] == settings and
+                all(a is b for a, b in zip(cache[0], sources))):
+            if not self.available.any():
+                print("WARNING THERE ARE NO FEASIBLE BUILDINGS TO CHOOSE "
+                      "FROM")
+                return
+            return cache[1]
+
+        df, p = self._prepare_proposals(profit_to_prob_func)
+        if df is None:
+            return
+        proposals = (df, p,
+                     proposal_select.ProposalSampler(
+                         df, p, multiparcel=self.keep_suboptimal,
+                         parcels=self.parcels),
+                     proposal_select.PriorityIndex(df, parcels=self.parcels))
+        self._proposal_cache = (sources, proposals, settings)
+        return proposals
+
+    def build_sampler(self, profit_to_prob_func=None):
+        """
+        Prepare the feasible proposals and their probabilities once and
+        return a ProposalSampler that can be passed to pick() for repeated
+        picks, e.g. in replicate studies, without repeating that work.
+
+        Parameters
+        ----------
+        profit_to_prob_func: function, optional
+            As in pick()
+
+        Returns
+        -------
+        None if there are no feasible buildings
+        sampler : ProposalSampler
+        """
+        df, p = self._prepare_proposals(profit_to_prob_func)
+        if df is None:
+            return
+        return proposal_select.ProposalSampler(
+            df, p, multiparcel=self.keep_suboptimal, parcels=self.parcels)
+
+    def _prepare_proposals(self, profit_to_prob_func, joint=False,
+                           current_job_spaces=None):
+        """
+        Helper method to pick(). Builds the DataFrame of feasible proposals
+        and their development probabilities.
+
+        Parameters
+        ----------
+        profit_to_prob_func: function, optional
+            As in pick()
+        joint : bool, optional
+            If True, compute net residential units and net job spaces for
+            pick_joint() instead of a single net_units column
+        current_job_spaces : Series, optional
+            As in pick_joint()
+
+        Returns
+        -------
+        df : DataFrame
+            DataFrame of buildings, or None if there are no feasible
+            buildings
+        p : Series
+            Development probability for each building
+        """
         empty_warn = "WARNING THERE ARE NO FEASIBLE BUILDINGS TO CHOOSE FROM"
 
-        if len(self.feasibility) == 0 or self.feasibility.empty:
+        if (len(self.feasibility) == 0 or self.feasibility.empty or
+                not self.available.any()):
             print(empty_warn)
-            return
+            return None, None
 
         # Get DataFrame of potential buildings from SqFtProForma steps
         # Unnecessary if feasibility table is already in long-form, as is the
         # case if running developer with sub-optimal proposals retained.
-        if not self.keep_suboptimal:
-            df = self._get_dataframe_of_buildings()
-        else:
-            df = self.feasibility
+        stats = self.stats
+        with stats.timer('pick.candidates'):
+            if not self.keep_suboptimal:
+                df = self._get_dataframe_of_buildings()
+            else:
+                df = self._available_feasibility()
+        stats.count('pick.candidates', len(df))
 
-        df = self._remove_infeasible_buildings(df)
-        df = self._calculate_net_units(df)
+        with stats.timer('pick.filters'):
+            df = self._remove_infeasible_buildings(df)
+            if joint:
+                df = self._calculate_joint_net_units(df, current_job_spaces)
+            else:
+                df = self._calculate_net_units(df)
+        stats.count('pick.feasible', len(df))
 
         if len(df) == 0 or df.empty:
             print(empty_warn)
-            return
+            return None, None
 
-        print("Sum of net units that are profitable: {:,}".format(
-            int(df.net_units.sum())))
+        if joint:
+            print("Sum of net residential units that are profitable: "
+                  "{:,}".format(int(df.net_residential_units.clip(0).sum())))
+            print("Sum of net job spaces that are profitable: {:,}".format(
+                int(df.net_job_spaces.clip(0).sum())))
+        else:
+            print("Sum of net units that are profitable: {:,}".format(
+                int(df.net_units.sum())))
 
         # Parcel id needs to be a column rather than the index if
         # selecting proposals with multiple proposals per parcel
@@ -230,20 +752,11 @@ class Developer(object):
             df.index.name = 'parcel_id'
             df = df.reset_index()
 
-        # Generate development probabilities and pick buildings to build
-        p, df = self._calculate_probabilities(df, profit_to_prob_func)
-
-        # Select proposals to build
-        build_idx = self._select_buildings(df, p, custom_selection_func)
+        # Generate development probabilities
+        with stats.timer('pick.probabilities'):
+            p, df = self._calculate_probabilities(df, profit_to_prob_func)
 
-        # Drop built buildings from self.feasibility attribute if desired
-        if not self.keep_suboptimal:
-            self._drop_built_buildings(build_idx)
-
-        # Prep DataFrame of new buildings
-        new_df = self._prepare_new_buildings(df, build_idx)
-
-        return new_df
+        return df, p
 
     def _get_dataframe_of_buildings(self):
         """
@@ -256,8 +769,11 @@ class Developer(object):
         """
         if self.forms is None or isinstance(self.forms, list):
             df = self.keep_form_with_max_profit(self.forms)
+        elif isinstance(self.feasibility,
+                        (FeasibilityCube, FeasibilityStore)):
+            df = self._available_feasibility().form_frame(self.forms)
         else:
-            df = self.feasibility[self.forms]
+            df = self._available_feasibility()[self.forms]
 
         return df
 
@@ -281,10 +797,35 @@ class Developer(object):
                           max_profit
                           max_profit_far
                           total_cost
+
+        Returns a Series, indexed like f, of the form with the largest
+        value of colname.  Parcels with no value for any form are omitted.
+        """
+        forms, rows, winner = Developer._max_form_positions(f, colname)
+        return pd.Series(forms[winner], index=f.index[rows])
+
+    @staticmethod
+    def _max_form_positions(f, colname):
         """
-        df = f.stack(level=0)[[colname]].stack().unstack(level=1).reset_index(
-            level=1, drop=True)
-        return df.idxmax(axis=1)
+        Array version of _max_form.  Extracts a (parcels x forms) array of
+        colname and takes nanargmax over the form axis.
+
+        Returns
+        -------
+        forms : ndarray
+            Forms in the order of the form axis
+        rows : ndarray
+            Positions of the parcels in f which have a value for any form
+        winner : ndarray
+            Position in forms of the winning form for each of rows
+        """
+        forms = np.asarray(f.columns.get_level_values(0).unique(),
+                           dtype='object')
+        values = np.column_stack(
+            [f[form][colname].values for form in forms]).astype('float')
+        rows = np.flatnonzero(~np.isnan(values).all(axis=1))
+        winner = np.nanargmax(values[rows], axis=1)
+        return forms, rows, winner
 
     def keep_form_with_max_profit(self, forms=None):
         """
@@ -301,22 +842,32 @@ class Developer(object):
         Returns
         -------
         DataFrame consisting of a subset of self.feasibility, where only
-        the most profitable form for each parcel is included.
+        the most profitable form for each parcel is included.  Parcels
+        that are marked as unavailable are left out.
 
         """
-        f = self.feasibility
+        f = self._available_feasibility()
+
+        if isinstance(f, (FeasibilityCube, FeasibilityStore)):
+            return f.max_form(forms)
 
         if forms is not None:
             f = f[forms]
 
-        if len(f) > 0:
-            mu = self._max_form(f, "max_profit")
-            indexes = [tuple(x) for x in mu.reset_index().values]
-        else:
-            indexes = []
-        df = f.stack(level=0).loc[indexes]
-        df.index.names = ["parcel_id", "form"]
-        df = df.reset_index(level=1)
+        fields = f.columns.get_level_values(1).unique()
+        if len(f) == 0:
+            df = pd.DataFrame(columns=['form'] + list(fields))
+            df.index.name = "parcel_id"
+            return df
+
+        forms, rows, winner = self._max_form_positions(f, "max_profit")
+
+        # gather the fields of the winning form for each parcel
+        df = pd.DataFrame({'form': forms[winner]}, index=f.index[rows])
+        for field in fields:
+            values = np.column_stack([f[form][field].values for form in forms])
+            df[field] = values[rows, winner]
+        df.index.name = "parcel_id"
         return df
 
     def _remove_infeasible_buildings(self, df):
@@ -340,14 +891,21 @@ class Developer(object):
         if len(df) == 0 or df.empty:
             return df
 
+        n_proposals = len(df)
         df = df[df.max_profit_far > 0]
-        self.ave_unit_size[
-            self.ave_unit_size < self.min_unit_size
-        ] = self.min_unit_size
-        df.loc[:, 'ave_unit_size'] = self.ave_unit_size
-        df.loc[:, 'parcel_size'] = self.parcel_size
-        df.loc[:, 'current_units'] = self.current_units
+        self.stats.count('pick.zero_far', n_proposals - len(df))
+
+        # parcel labels are converted once to dense integer codes (positions
+        # in self.parcels); attributes are gathered, and proposals later
+        # grouped and de-duplicated, by code
+        attributes = self._parcel_attributes()
+        codes = self.parcels.get_indexer(df.index).astype('int32')
+        df = df.assign(parcel_code=codes,
+                       **{name: np.take(values, codes)
+                          for name, values in attributes.items()})
+        n_proposals = len(df)
         df = df[df.parcel_size < self.max_parcel_size]
+        self.stats.count('pick.max_parcel_size', n_proposals - len(df))
 
         df['residential_units'] = (df.residential_sqft /
                                    df.ave_unit_size).round()
@@ -377,7 +935,42 @@ class Developer(object):
             df['net_units'] = df.residential_units - df.current_units
         else:
             df['net_units'] = df.job_spaces - df.current_units
-        return df[df.net_units > 0]
+        feasible = df.net_units > 0
+        self.stats.count('pick.net_units', len(df) - feasible.sum())
+        return df[feasible]
+
+    def _calculate_joint_net_units(self, df, current_job_spaces=None):
+        """
+        Helper method to pick_joint(). Calculates the net_residential_units
+        and net_job_spaces columns, and removes buildings that add neither
+        residential units nor job spaces.
+
+        Parameters
+        ----------
+        df : DataFrame
+            DataFrame of buildings from _remove_infeasible_buildings()
+        current_job_spaces : Series, optional
+            As in pick_joint()
+
+        Returns
+        -------
+        df : DataFrame
+        """
+        if len(df) == 0 or df.empty:
+            return df
+
+        if current_job_spaces is None:
+            current = 0
+        else:
+            s = current_job_spaces[~current_job_spaces.index.duplicated()]
+            current = np.take(s.reindex(self.parcels).fillna(0).values,
+                              df.parcel_code.values)
+
+        df['net_residential_units'] = df.residential_units - df.current_units
+        df['net_job_spaces'] = df.job_spaces - current
+        feasible = (df.net_residential_units > 0) | (df.net_job_spaces > 0)
+        self.stats.count('pick.net_units', len(df) - feasible.sum())
+        return df[feasible]
 
     @staticmethod
     def _calculate_probabilities(df, profit_to_prob_func):
@@ -408,7 +1001,9 @@ class Developer(object):
             p = df.max_profit_per_size / df.max_profit_per_size.sum()
         return p, df
 
-    def _select_buildings(self, df, p, custom_selection_func):
+    def _select_buildings(self, df, p, custom_selection_func, rng=None,
+                          n_jobs=1, selection_method='weighted_random',
+                          sampler=None, index=None):
         """
         Helper method to pick(). Selects buildings to build based on
         development probabilities.
@@ -424,6 +1019,17 @@ class Developer(object):
             development after probabilities are calculated. Must have
             parameters (self, df, p) and return a numpy array of buildings to
             build (i.e. df.index.values)
+        rng : Generator, SeedSequence or int, optional
+            Random Generator or seed passed on to the proposal selection
+            functions
+        n_jobs : int, optional
+            Number of threads used for partitioned selection
+        selection_method : str, optional
+            Name of a strategy in proposal_select.SELECTION_METHODS
+        sampler : ProposalSampler, optional
+            Sampler to draw buildings from
+        index : PriorityIndex, optional
+            Priority index used by the top_profit selection method
 
         Returns
         -------
@@ -433,55 +1039,212 @@ class Developer(object):
         """
         warning = "WARNING THERE ARE NOT ENOUGH PROFITABLE UNITS TO " \
                   "MATCH DEMAND"
+        # a sampler or priority index holds proposals on parcels that have
+        # been built since, which are left out of the units on offer
+        net_units = df.net_units.values
+        if sampler is not None:
+            net_units = net_units[
+                self._sampler_availability(sampler)[sampler.codes]]
+        elif index is not None:
+            net_units = net_units[self._parcel_available[index.codes]]
         if isinstance(self.target_units, Number):
             target_units = self.target_units
-            insufficient_units = df.net_units.sum() < target_units
+            insufficient_units = net_units.sum() < target_units
             if insufficient_units:
                 print(warning)
         elif isinstance(self.target_units, pd.DataFrame):
             target_units = self.target_units.target_units.sum()
             insufficient_units = \
-                df.net_units.sum() < target_units
+                net_units.sum() < target_units
             if insufficient_units:
                 print(warning)
 
         if custom_selection_func is not None:
-            build_idx = custom_selection_func(self, df, p, self.target_units)
+            with self.stats.timer('pick.custom_selection_func'):
+                build_idx = custom_selection_func(self, df, p,
+                                                  self.target_units)
+
+        elif (self.partition_col is not None and
+              isinstance(self.target_units, pd.DataFrame)):
+            build_idx = self._select_partitioned(df, p, rng, n_jobs,
+                                                 selection_method)
+
+        else:
+            build_idx = self._select_target(df, p, target_units, rng,
+                                            selection_method, sampler, index)
+
+        return build_idx
+
+    def _select_target(self, df, p, target_units, rng,
+                       selection_method='weighted_random', sampler=None,
+                       index=None):
+        """
+        Helper method to _select_buildings(). Selects buildings to meet a
+        single target number of units.
+
+        Parameters
+        ----------
+        df : DataFrame
+            DataFrame of buildings from _calculate_probabilities method
+        p : Series or ndarray
+            Probabilities from _calculate_probabilities method
+        target_units : int
+            Number of units to build
+        rng : Generator, SeedSequence or int
+        selection_method : str
+            Name of a strategy in proposal_select.SELECTION_METHODS
+        sampler : ProposalSampler, optional
+            Sampler to draw buildings from instead of the selection method
+        index : PriorityIndex, optional
+            Priority index to pop buildings from if selection_method is
+            "top_profit"
 
-        elif target_units <= 0:
-            build_idx = []
+        Returns
+        -------
+        build_idx : ndarray
+        """
+        single, multiparcel = \
+            proposal_select.SELECTION_METHODS[selection_method]
 
-        elif self.keep_suboptimal:
-            build_idx = proposal_select.weighted_random_choice_multiparcel(df,
-                                                          p, target_units)  # noqa
+        if target_units <= 0:
+            return df.index.values[:0]
 
+        if index is not None and selection_method == 'top_profit':
+            return index.pop(target_units,
+                             parcel_available=self._parcel_available)
+
+        if sampler is not None:
+            return sampler.sample(
+                target_units, rng=rng,
+                parcel_available=self._sampler_availability(sampler))
+
+        if self.keep_suboptimal:
+            return multiparcel(df, p, target_units, rng=rng)
+
+        if df.net_units.sum() < target_units:
+            return df.index.values
+
+        return single(df, p, target_units, rng=rng)
+
+    def _sampler_availability(self, sampler):
+        """
+        Return the availability of the parcels of a ProposalSampler.
+        Parcels that have been dropped from self.feasibility since the
+        sampler was built are unavailable.
+        """
+        available = self.parcel_available & self._parcel_present
+        if sampler.parcels is self.parcels:
+            return available
+        positions = self.parcels.get_indexer(sampler.parcels)
+        return (positions >= 0) & available[positions]
+
+    def _select_partitioned(self, df, p, rng, n_jobs,
+                            selection_method='weighted_random'):
+        """
+        Helper method to _select_buildings(). Meets the target of each
+        partition in self.target_units independently, using the proposals
+        of that partition.  Partitions are selected in parallel, each with
+        its own random stream spawned from rng.
+
+        Parameters
+        ----------
+        df : DataFrame
+            DataFrame of buildings from _calculate_probabilities method
+        p : Series or ndarray
+            Probabilities from _calculate_probabilities method
+        rng : Generator, SeedSequence or int
+        n_jobs : int
+            Number of threads
+        selection_method : str
+            Name of a strategy in proposal_select.SELECTION_METHODS
+
+        Returns
+        -------
+        build_idx : ndarray
+        """
+        targets = self.target_units.target_units
+        rngs = utils.spawn_rngs(rng, len(targets))
+        p = np.asarray(p, dtype='float')
+
+        # group proposals by the position of their partition in targets;
+        # proposals in partitions without a target are never built
+        codes = pd.Index(targets.index).get_indexer(
+            df[self.partition_col].values)
+        order = np.argsort(codes, kind='mergesort')
+        bounds = np.searchsorted(codes[order], np.arange(len(targets) + 1))
+
+        def select(i):
+            rows = order[bounds[i]:bounds[i + 1]]
+            sub_p = p[rows]
+            if len(rows) == 0 or sub_p.sum() <= 0:
+                return df.index.values[:0]
+            return self._select_target(df.iloc[rows], sub_p / sub_p.sum(),
+                                       targets.iloc[i], rngs[i],
+                                       selection_method)
+
+        if n_jobs > 1:
+            with ThreadPoolExecutor(n_jobs) as executor:
+                results = list(executor.map(select, range(len(targets))))
         else:
-            if insufficient_units:
-                build_idx = df.index.values
-            else:
-                build_idx = proposal_select.weighted_random_choice(df, p,
-                                                             target_units)  # noqa
+            results = [select(i) for i in range(len(targets))]
+
+        build_idx = np.concatenate(results)
+
+        # a parcel can only be built once, even if its proposals fall in
+        # several partitions
+        if self.keep_suboptimal:
+            codes = df.parcel_code.loc[build_idx]
+            build_idx = build_idx[~codes.duplicated().values]
 
         return build_idx
 
-    def _drop_built_buildings(self, build_idx):
+    def _drop_built_buildings(self, df, build_idx, parcels=None):
         """
         Helper method to pick(). Drops built buildings from the
-        self.feasibility attribute DataFrame.
+        self.feasibility attribute DataFrame, or marks their parcels as
+        unavailable if mask_after_build or keep_suboptimal is set.
 
         Parameters
         ----------
+        df : DataFrame
+            DataFrame of buildings from the _calculate_probabilities method
         build_idx : Array-like
             Index of buildings selected for development, from
             _buildings_to_build method
+        parcels : Index, optional
+            Parcel identifiers that the parcel_code column of df refers to,
+            if df was not built from the current feasibility table
 
         Returns
         -------
         None
         """
 
-        if self.drop_after_build:
-            self.feasibility = self.feasibility.drop(build_idx)
+        if not self.drop_after_build:
+            return
+
+        self._update_availability()
+        codes = df.parcel_code.loc[build_idx].values
+        if parcels is not None and parcels is not self.parcels:
+            codes = self.parcels.get_indexer(parcels[codes])
+            codes = codes[codes >= 0]
+        self._parcel_available[codes] = False
+
+        if not (self.mask_after_build or self.keep_suboptimal or
+                self.priority_index):
+            # drop the rows of the built parcels; the row codes are
+            # filtered along with them rather than rebuilt
+            built = np.zeros(len(self._parcels), dtype='bool')
+            built[codes] = True
+            rows = np.flatnonzero(~built[self._row_codes])
+            if isinstance(self.feasibility,
+                          (FeasibilityCube, FeasibilityStore)):
+                self.feasibility = self.feasibility.take(rows)
+            else:
+                self.feasibility = self.feasibility.iloc[rows]
+            self._row_codes = self._row_codes[rows]
+            self._proposal_available = self._proposal_available[rows]
+            self._availability_of = self.feasibility
 
     def _prepare_new_buildings(self, df, build_idx):
         """
@@ -502,7 +1265,7 @@ class Developer(object):
 
         """
 
-        new_df = df.loc[build_idx]
+        new_df = df.loc[build_idx].drop('parcel_code', axis=1)
 
         drop = True
         if 'parcel_id' not in df.columns:
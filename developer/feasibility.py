@@ -0,0 +1,797 @@
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+
+class FeasibilityCube(object):
+    """
+    Dense representation of pro forma feasibility results, stored as a
+    single parcel x form x field ndarray.
+
+    This holds the same information as the "wide" DataFrame that the
+    Developer model builds from a dictionary of lookup results (one
+    column block per form), but form competition, filtering and dropping
+    of parcels become array operations rather than MultiIndex reshaping.
+
+    Parameters
+    ----------
+    values : ndarray
+        Float array of shape (parcels, forms, fields).  Forms that are not
+        feasible for a parcel are NaN across all fields.
+    index : Index
+        Parcel identifiers, one per parcel along the first axis of values
+    forms : list of strings
+        Names of the forms along the second axis of values
+    fields : list of strings
+        Names of the feasibility columns along the third axis of values,
+        e.g. "max_profit" or "building_sqft"
+    labels : dict, optional
+        Label maps for non-numeric fields such as "parking_config".  Keys
+        are field names and values are arrays of labels; the field itself
+        stores float codes into that array.
+
+    """
+
+    def __init__(self, values, index, forms, fields, labels=None):
+        values = np.asarray(values, dtype='float')
+        assert values.ndim == 3
+        assert values.shape == (len(index), len(forms), len(fields))
+
+        self.values = values
+        self.index = pd.Index(index, name='parcel_id')
+        self.forms = list(forms)
+        self.fields = list(fields)
+        self.labels = {} if labels is None else labels
+
+        self._form_pos = {form: i for i, form in enumerate(self.forms)}
+        self._field_pos = {field: i for i, field in enumerate(self.fields)}
+
+    @classmethod
+    def from_dict(cls, feasibility):
+        """
+        Create a FeasibilityCube from a dictionary of lookup results.
+
+        Parameters
+        ----------
+        feasibility : dict
+            Keys are building forms and values are the DataFrames returned
+            by SqFtProForma.lookup for that form (one row per parcel).
+
+        Returns
+        -------
+        FeasibilityCube
+        """
+        forms = list(feasibility.keys())
+        frames = [feasibility[form] for form in forms]
+
+        index = pd.Index([])
+        fields = []
+        for frame in frames:
+            if len(frame.columns) == 0:
+                continue
+            assert frame.index.is_unique, \
+                "FeasibilityCube requires one proposal per parcel and form"
+            index = frame.index if len(index) == 0 else \
+                index.append(frame.index[~frame.index.isin(index)])
+            fields += [col for col in frame.columns if col not in fields]
+
+        labels = {}
+        for field in fields:
+            columns = [frame[field] for frame in frames
+                       if field in frame.columns]
+            if all(pd.api.types.is_numeric_dtype(col) for col in columns):
+                continue
+            uniques = pd.unique(np.concatenate(
+                [col.dropna().values for col in columns]))
+            labels[field] = np.asarray(uniques, dtype='object')
+
+        values = np.full((len(index), len(forms), len(fields)), np.nan)
+        for i, frame in enumerate(frames):
+            if len(frame) == 0:
+                continue
+            rows = index.get_indexer(frame.index)
+            for j, field in enumerate(fields):
+                if field not in frame.columns:
+                    continue
+                col = frame[field].values
+                if field in labels:
+                    codes = pd.Index(labels[field]).get_indexer(col)
+                    col = np.where(codes < 0, np.nan, codes)
+                values[rows, i, j] = col
+
+        return cls(values, index, forms, fields, labels)
+
+    @classmethod
+    def from_frame(cls, df):
+        """
+        Create a FeasibilityCube from a "wide" feasibility DataFrame with
+        hierarchical columns, where the first level is the form and the
+        second level is the feasibility field.
+
+        Parameters
+        ----------
+        df : DataFrame
+
+        Returns
+        -------
+        FeasibilityCube
+        """
+        forms = df.columns.get_level_values(0).unique()
+        return cls.from_dict({form: df[form].dropna(how='all')
+                              for form in forms})
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def empty(self):
+        return self.values.size == 0
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def field(self, name, forms=None):
+        """
+        Return a (parcels x forms) array of one feasibility field.
+
+        Parameters
+        ----------
+        name : string
+            Name of the field, e.g. "max_profit"
+        forms : list of strings, optional
+            Forms to return.  If None, all forms are returned.
+
+        Returns
+        -------
+        ndarray
+        """
+        j = self._field_pos[name]
+        if forms is None:
+            return self.values[:, :, j]
+        return self.values[:, [self._form_pos[f] for f in forms], j]
+
+    def select_forms(self, forms):
+        """
+        Return a FeasibilityCube restricted to a subset of forms.
+
+        Parameters
+        ----------
+        forms : list of strings
+
+        Returns
+        -------
+        FeasibilityCube
+        """
+        pos = [self._form_pos[form] for form in forms]
+        return FeasibilityCube(self.values[:, pos, :], self.index, forms,
+                               self.fields, self.labels)
+
+    def take(self, positions):
+        """
+        Return a FeasibilityCube with only the parcels at the given
+        positions.
+
+        Parameters
+        ----------
+        positions : array-like of int or bool
+
+        Returns
+        -------
+        FeasibilityCube
+        """
+        return FeasibilityCube(self.values[positions], self.index[positions],
+                               self.forms, self.fields, self.labels)
+
+    def drop(self, parcel_ids):
+        """
+        Return a FeasibilityCube without the given parcels.  Mirrors
+        DataFrame.drop so the cube can stand in for the wide feasibility
+        DataFrame in the Developer model.
+
+        Parameters
+        ----------
+        parcel_ids : array-like
+            Parcel identifiers to remove
+
+        Returns
+        -------
+        FeasibilityCube
+        """
+        return self.take(~self.index.isin(parcel_ids))
+
+    def form_frame(self, form):
+        """
+        Return the feasibility of a single form as a DataFrame, with one
+        row per parcel for which the form is feasible.
+
+        Parameters
+        ----------
+        form : string
+
+        Returns
+        -------
+        DataFrame
+        """
+        block = self.values[:, self._form_pos[form], :]
+        rows = np.flatnonzero(~np.isnan(block).all(axis=1))
+        return self._to_frame(block[rows], self.index[rows])
+
+    def max_form(self, forms=None):
+        """
+        Keep only the most profitable form for each parcel.
+
+        Parameters
+        ----------
+        forms : list of strings, optional
+            Forms to compete.  If None, all forms are used.
+
+        Returns
+        -------
+        DataFrame
+            Indexed by parcel_id, with a "form" column followed by the
+            feasibility fields of the winning form.  Parcels for which no
+            form is feasible are omitted.
+        """
+        cube = self if forms is None else self.select_forms(forms)
+        profit = cube.field('max_profit')
+
+        rows = np.flatnonzero(~np.isnan(profit).all(axis=1))
+        winner = np.argmax(
+            np.where(np.isnan(profit[rows]), -np.inf, profit[rows]), axis=1)
+
+        df = cube._to_frame(cube.values[rows, winner, :], cube.index[rows])
+        df.insert(0, 'form', np.asarray(cube.forms, dtype='object')[winner])
+        return df
+
+    def to_frame(self):
+        """
+        Convert to the "wide" feasibility DataFrame with hierarchical
+        columns (form, field).
+
+        Returns
+        -------
+        DataFrame
+        """
+        return pd.concat(
+            [self._to_frame(self.values[:, i, :], self.index)
+             for i in range(len(self.forms))],
+            keys=self.forms, axis=1)
+
+    def _to_frame(self, block, index):
+        """
+        Build a DataFrame from a (parcels x fields) block of values,
+        restoring labels for non-numeric fields.
+        """
+        df = pd.DataFrame(block, index=index, columns=self.fields)
+        for field, labels in self.labels.items():
+            codes = block[:, self._field_pos[field]]
+            missing = np.isnan(codes)
+            decoded = np.empty(len(codes), dtype='object')
+            decoded[~missing] = labels[codes[~missing].astype('int')]
+            decoded[missing] = np.nan
+            df[field] = decoded
+        return df
+
+
+class FeasibilityStore(object):
+    """
+    On-disk, memory-mapped representation of pro forma feasibility results
+    for runs that are too large to keep in memory next to the other
+    tables of a simulation.
+
+    Each feasibility field of each form is stored as a one-dimensional
+    NumPy array (one value per parcel, NaN where the form is not feasible)
+    in its own .npy file, and the parcel identifiers in index.npy::
+
+        path/meta.json
+        path/index.npy
+        path/residential/max_profit.npy
+        path/residential/building_sqft.npy
+        ...
+
+    Files are opened as memory maps when first used, so that form
+    competition and filtering only page in the fields and parcels they
+    touch.  The store has the same interface as FeasibilityCube and can be
+    passed to the Developer model in its place; take(), drop() and
+    select_forms() return views on the same files rather than copies.
+
+    Stores are usually written with SqFtProForma.lookup_to_store and
+    opened with FeasibilityStore(path).
+
+    Parameters
+    ----------
+    path : str
+        Directory of the store
+
+    """
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.path = path
+        self.forms = meta['forms']
+        self.fields = meta['fields']
+        self.labels = {field: np.asarray(labels, dtype='object')
+                       for field, labels in meta['labels'].items()}
+        self.fingerprint = meta.get('fingerprint')
+        self.complete = meta.get('complete', False)
+
+        self._all_index = pd.Index(
+            np.load(os.path.join(path, 'index.npy')), name='parcel_id')
+        self._rows = None
+        self._arrays = {}
+        self._mode = 'r'
+
+    @classmethod
+    def create(cls, path, index, forms, fields, labels=None,
+               fingerprint=None):
+        """
+        Create an empty store, with all values missing, to be filled with
+        write().
+
+        Parameters
+        ----------
+        path : str
+            Directory of the store.  Files of an existing store are
+            overwritten.
+        index : Index
+            Parcel identifiers, numeric or strings
+        forms : list of strings
+        fields : list of strings
+        labels : dict, optional
+            Label arrays for non-numeric fields, as in FeasibilityCube.
+            Values written to these fields must be among the labels.
+        fingerprint : str, optional
+            Identifies the inputs the store is computed from, so that it
+            can be reused when they have not changed
+
+        Returns
+        -------
+        FeasibilityStore
+            Open for writing
+        """
+        labels = {} if labels is None else labels
+        index = np.asarray(index)
+        if index.dtype == object:
+            index = index.astype('U')
+        for form in forms:
+            directory = os.path.join(path, form)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            for field in fields:
+                arr = np.lib.format.open_memmap(
+                    os.path.join(directory, field + '.npy'), mode='w+',
+                    dtype='float64', shape=(len(index),))
+                arr[:] = np.nan
+                del arr
+        np.save(os.path.join(path, 'index.npy'), index)
+        cls._write_meta(path, forms, fields, labels, fingerprint, False)
+
+        store = cls(path)
+        store._mode = 'r+'
+        return store
+
+    @staticmethod
+    def _write_meta(path, forms, fields, labels, fingerprint, complete):
+        meta = {'forms': list(forms), 'fields': list(fields),
+                'labels': {field: [str(label) for label in values]
+                           for field, values in labels.items()},
+                'fingerprint': fingerprint, 'complete': complete}
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+
+    def write(self, form, df):
+        """
+        Write the lookup results of one form for some of the parcels, e.g.
+        one chunk at a time.
+
+        Parameters
+        ----------
+        form : string
+        df : DataFrame
+            Result of SqFtProForma.lookup, with one row per parcel
+        """
+        if len(df) == 0:
+            return
+        assert df.index.is_unique, \
+            "FeasibilityStore requires one proposal per parcel and form"
+        rows = self._all_index.get_indexer(df.index)
+        if (rows < 0).any():
+            raise ValueError('parcels are not in the index of the store')
+        for field in self.fields:
+            if field not in df.columns:
+                continue
+            values = df[field].values
+            if field in self.labels:
+                codes = pd.Index(self.labels[field]).get_indexer(values)
+                if (codes[pd.notnull(values)] < 0).any():
+                    raise ValueError('unknown labels in {}'.format(field))
+                values = np.where(codes < 0, np.nan, codes)
+            self._array(form, field)[rows] = values
+
+    def close(self):
+        """
+        Flush written values to disk, mark the store as complete and reopen
+        it read-only.
+        """
+        for arr in self._arrays.values():
+            arr.flush()
+        self._arrays = {}
+        self._mode = 'r'
+        self.complete = True
+        self._write_meta(self.path, self.forms, self.fields, self.labels,
+                         self.fingerprint, True)
+
+    def _array(self, form, field):
+        key = (form, field)
+        if key not in self._arrays:
+            self._arrays[key] = np.load(
+                os.path.join(self.path, form, field + '.npy'),
+                mmap_mode=self._mode)
+        return self._arrays[key]
+
+    def _gather(self, form, field, positions=None):
+        """
+        Values of one field of one form, for the parcels at positions in
+        this view (all parcels if None)
+        """
+        arr = self._array(form, field)
+        if self._rows is not None:
+            positions = self._rows if positions is None \
+                else self._rows[positions]
+        if positions is None:
+            return np.array(arr)
+        return arr[positions]
+
+    def _view(self, rows=None, forms=None):
+        view = object.__new__(FeasibilityStore)
+        view.__dict__.update(self.__dict__)
+        if rows is not None:
+            view._rows = rows if self._rows is None else self._rows[rows]
+        if forms is not None:
+            view.forms = list(forms)
+        return view
+
+    @property
+    def index(self):
+        if self._rows is None:
+            return self._all_index
+        return self._all_index[self._rows]
+
+    def __len__(self):
+        return len(self._all_index) if self._rows is None \
+            else len(self._rows)
+
+    @property
+    def empty(self):
+        return len(self) == 0 or len(self.forms) == 0 or \
+            len(self.fields) == 0
+
+    @property
+    def shape(self):
+        return (len(self), len(self.forms), len(self.fields))
+
+    def field(self, name, forms=None):
+        """
+        Return a (parcels x forms) array of one feasibility field.
+
+        Parameters
+        ----------
+        name : string
+            Name of the field, e.g. "max_profit"
+        forms : list of strings, optional
+            Forms to return.  If None, all forms are returned.
+
+        Returns
+        -------
+        ndarray
+        """
+        forms = self.forms if forms is None else forms
+        return np.column_stack([self._gather(form, name) for form in forms])
+
+    def select_forms(self, forms):
+        """
+        Return a view of the store restricted to a subset of forms.
+
+        Parameters
+        ----------
+        forms : list of strings
+
+        Returns
+        -------
+        FeasibilityStore
+        """
+        return self._view(forms=forms)
+
+    def take(self, positions):
+        """
+        Return a view of the store with only the parcels at the given
+        positions.
+
+        Parameters
+        ----------
+        positions : array-like of int or bool
+
+        Returns
+        -------
+        FeasibilityStore
+        """
+        positions = np.asarray(positions)
+        if positions.dtype == bool:
+            positions = np.flatnonzero(positions)
+        return self._view(rows=positions)
+
+    def drop(self, parcel_ids):
+        """
+        Return a view of the store without the given parcels.
+
+        Parameters
+        ----------
+        parcel_ids : array-like
+            Parcel identifiers to remove
+
+        Returns
+        -------
+        FeasibilityStore
+        """
+        return self.take(~self.index.isin(parcel_ids))
+
+    def form_frame(self, form):
+        """
+        Return the feasibility of a single form as a DataFrame, with one
+        row per parcel for which the form is feasible (has a max_profit).
+
+        Parameters
+        ----------
+        form : string
+
+        Returns
+        -------
+        DataFrame
+        """
+        rows = np.flatnonzero(~np.isnan(self._gather(form, 'max_profit')))
+        return self._frame(
+            {field: self._gather(form, field, rows) for field in self.fields},
+            self.index[rows])
+
+    def max_form(self, forms=None, chunk_size=1000000):
+        """
+        Keep only the most profitable form for each parcel.  Profits are
+        compared chunk by chunk, and other fields are only read for the
+        winning form of each parcel.
+
+        Parameters
+        ----------
+        forms : list of strings, optional
+            Forms to compete.  If None, all forms are used.
+        chunk_size : int, optional
+            Number of parcels whose profits are held in memory at once
+
+        Returns
+        -------
+        DataFrame
+            Indexed by parcel_id, with a "form" column followed by the
+            feasibility fields of the winning form.  Parcels for which no
+            form is feasible are omitted.
+        """
+        forms = self.forms if forms is None else list(forms)
+        rows, winners = [], []
+        for start in range(0, len(self), chunk_size):
+            positions = np.arange(start, min(start + chunk_size, len(self)))
+            profit = np.column_stack(
+                [self._gather(form, 'max_profit', positions)
+                 for form in forms])
+            feasible = np.flatnonzero(~np.isnan(profit).all(axis=1))
+            rows.append(positions[feasible])
+            winners.append(np.argmax(np.where(
+                np.isnan(profit[feasible]), -np.inf, profit[feasible]),
+                axis=1))
+        rows = np.concatenate(rows) if rows else np.array([], dtype='int')
+        winner = np.concatenate(winners) if winners else rows
+
+        columns = {}
+        for field in self.fields:
+            values = np.empty(len(rows))
+            for i, form in enumerate(forms):
+                mask = winner == i
+                values[mask] = self._gather(form, field, rows[mask])
+            columns[field] = values
+
+        df = self._frame(columns, self.index[rows])
+        df.insert(0, 'form', np.asarray(forms, dtype='object')[winner])
+        return df
+
+    def to_cube(self):
+        """
+        Load the store (or this view of it) into a FeasibilityCube.
+
+        Returns
+        -------
+        FeasibilityCube
+        """
+        values = np.stack([self.field(field) for field in self.fields],
+                          axis=2)
+        return FeasibilityCube(values, self.index, self.forms, self.fields,
+                               self.labels)
+
+    def to_frame(self):
+        """
+        Convert to the "wide" feasibility DataFrame with hierarchical
+        columns (form, field).
+
+        Returns
+        -------
+        DataFrame
+        """
+        return self.to_cube().to_frame()
+
+    def _frame(self, columns, index):
+        """
+        Build a DataFrame from a dictionary of field arrays, restoring
+        labels for non-numeric fields.
+        """
+        df = pd.DataFrame(columns, index=index, columns=self.fields)
+        for field, labels in self.labels.items():
+            codes = columns[field]
+            missing = np.isnan(codes)
+            decoded = np.empty(len(codes), dtype='object')
+            decoded[~missing] = labels[codes[~missing].astype('int')]
+            decoded[missing] = np.nan
+            df[field] = decoded
+        return df
+
+
+def to_parquet(feasibility, path, part=0):
+    """
+    Write feasibility results to a Parquet dataset in long format, with
+    one row per proposal, partitioned by form::
+
+        path/form=office/part-00000.parquet
+        path/form=residential/part-00000.parquet
+
+    Parcel identifiers are stored in a parcel_id column and text columns
+    such as parking_config are dictionary encoded, so they are read back
+    as categoricals.  Writing several parts, e.g. one per chunk of parcels,
+    builds up a single dataset.  Requires pyarrow.
+
+    Parameters
+    ----------
+    feasibility : dict, DataFrame or FeasibilityCube
+        A dictionary of lookup results keyed by form, a "wide" feasibility
+        DataFrame with (form, field) columns, a "long" DataFrame with a
+        "form" column (as used with keep_suboptimal), or a
+        FeasibilityCube
+    path : str
+        Directory of the dataset
+    part : int, optional
+        Number of the part written for each form.  An existing part with
+        the same number is replaced.
+    """
+    _require_pyarrow()
+    for form, df in _form_frames(feasibility):
+        if len(df) == 0:
+            continue
+        directory = os.path.join(path, 'form={}'.format(form))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        name = 'part-{:05d}.parquet'.format(part)
+        # written under a hidden name, which readers skip, and renamed so
+        # that a part either exists whole or not at all
+        tmp = os.path.join(directory, '.' + name)
+        pq.write_table(pa.Table.from_pandas(_long_frame(df),
+                                            preserve_index=False), tmp)
+        os.replace(tmp, os.path.join(directory, name))
+
+
+def read_feasibility(path, forms=None, filters=None, columns=None,
+                     long=False):
+    """
+    Read feasibility results written by to_parquet or by the
+    developer-feasibility command.  Only the partitions of the requested
+    forms are read, and filters are pushed down to the Parquet reader so
+    that row groups without matching proposals are skipped.  Requires
+    pyarrow.
+
+    Parameters
+    ----------
+    path : str
+        Directory of the dataset
+    forms : str or list of str, optional
+        Forms to read.  If None, all forms are read.
+    filters : list, optional
+        Predicates in the pyarrow filters format, e.g.
+        ``[('max_profit', '>', 0)]`` or ``[('parcel_id', 'in', ids)]``
+    columns : list of str, optional
+        Feasibility columns to read.  If None, all columns are read.
+    long : bool, optional
+        If True, return a single DataFrame with a "form" column and one
+        row per proposal, as expected by the Developer model with
+        keep_suboptimal.
+
+    Returns
+    -------
+    feasibility : dict or DataFrame
+        Unless long is True, a dictionary of DataFrames indexed by
+        parcel_id and keyed by form, as returned by SqFtProForma.lookup,
+        which can be passed to the Developer model
+    """
+    _require_pyarrow()
+    if isinstance(forms, str):
+        forms = [forms]
+
+    expression = None
+    if filters:
+        expression = pq.filters_to_expression(filters)
+    if forms is not None:
+        form_filter = ds.field('form').isin(list(forms))
+        expression = form_filter if expression is None \
+            else expression & form_filter
+    if columns is not None:
+        columns = ['parcel_id', 'form'] + \
+            [col for col in columns if col not in ('parcel_id', 'form')]
+
+    dataset = ds.dataset(path, format='parquet', partitioning=ds.partitioning(
+        flavor='hive', dictionaries='infer'))
+    df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    if isinstance(df.parcel_id.dtype, pd.CategoricalDtype):
+        df['parcel_id'] = np.asarray(df.parcel_id)
+    df = df.set_index('parcel_id')
+    df['form'] = df.form.astype('object')
+
+    if long:
+        return df[['form'] + [col for col in df.columns if col != 'form']]
+
+    if forms is None:
+        forms = sorted(df.form.unique())
+    return OrderedDict(
+        (form, df[df.form.values == form].drop('form', axis=1))
+        for form in forms)
+
+
+def _form_frames(feasibility):
+    """
+    Yield (form, DataFrame) pairs from any of the feasibility formats
+    accepted by to_parquet.
+    """
+    if isinstance(feasibility, FeasibilityCube):
+        for form in feasibility.forms:
+            yield form, feasibility.form_frame(form)
+    elif isinstance(feasibility, dict):
+        for form, df in feasibility.items():
+            yield form, df
+    elif isinstance(feasibility.columns, pd.MultiIndex):
+        for form in feasibility.columns.get_level_values(0).unique():
+            yield form, feasibility[form].dropna(how='all')
+    else:
+        for form, df in feasibility.groupby('form', sort=False):
+            yield form, df.drop('form', axis=1)
+
+
+def _long_frame(df):
+    """
+    Move the parcel index of a lookup result into a parcel_id column and
+    make text columns categorical.
+    """
+    df = df.rename_axis('parcel_id').reset_index()
+    for col in df.columns:
+        if (df[col].dtype == object or
+                pd.api.types.is_string_dtype(df[col].dtype)):
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is required for Parquet feasibility I/O')
@@ -1,11 +1,18 @@
 import numpy as np
 import pandas as pd
 
+from developer.utils import get_rng
 
-def weighted_random_choice(df, p, target_units):
+
+def weighted_random_choice(df, p, target_units, rng=None):
     """
     Proposal selection using weighted random choice.
 
+    Proposals are ordered by Efraimidis-Spirakis keys, which gives the same
+    distribution as drawing them one at a time without replacement with
+    probability p, and only as many proposals as are needed to reach
+    target_units are sorted.
+
     Parameters
     ----------
     df : DataFrame
@@ -14,6 +21,9 @@ def weighted_random_choice(df, p, target_units):
         Weights for each proposal
     target_units: int
         Number of units to build
+    rng : Generator or int, optional
+        Random Generator or seed.  If None, the seed is drawn from NumPy's
+        global random state.
 
     Returns
     -------
@@ -21,25 +31,22 @@ def weighted_random_choice(df, p, target_units):
         Index of buildings selected for development
 
     """
-    # We don't know how many developments we will need, as they
-    # differ in net_units. If all developments have net_units of 1
-    # than we need target_units of them. So we choose the smaller
-    # of available developments and target_units.
-    num_to_sample = int(min(len(df.index), target_units))
-    choices = np.random.choice(df.index.values,
-                               size=num_to_sample,
-                               replace=False, p=p)
-    tot_units = df.net_units.loc[choices].values.cumsum()
-    ind = int(np.searchsorted(tot_units, target_units,
-                              side="left")) + 1
-    return choices[:ind]
+    keys = _exponential_keys(p, get_rng(rng))
+    positions = _ordered_prefix(keys, df.net_units.values, target_units)
+    return df.index.values[positions]
 
 
-def weighted_random_choice_multiparcel(df, p, target_units):
+def weighted_random_choice_multiparcel(df, p, target_units, rng=None):
     """
     Proposal selection using weighted random choice in the context of multiple
     proposals per parcel.
 
+    Every proposal gets one random priority key, only the best-keyed
+    proposal of each parcel is kept, and proposals are then taken in key
+    order until target_units is reached.  This is equivalent to drawing
+    proposals one at a time and discarding the remaining proposals of a
+    parcel once one of them has been chosen.
+
     Parameters
     ----------
     df : DataFrame
@@ -48,6 +55,9 @@ def weighted_random_choice_multiparcel(df, p, target_units):
         Weights for each proposal
     target_units: int
         Number of units to build
+    rng : Generator or int, optional
+        Random Generator or seed.  If None, the seed is drawn from NumPy's
+        global random state.
 
     Returns
     -------
@@ -55,29 +65,673 @@ def weighted_random_choice_multiparcel(df, p, target_units):
         Index of buildings selected for development
 
     """
-    choice_idx = weighted_random_choice(df, p, target_units)
-    choices = df.loc[choice_idx]
-    while True:
-        # If multiple proposals sampled for a given parcel, keep only one
-        choice_counts = choices.parcel_id.value_counts()
-        chosen_multiple = choice_counts[choice_counts > 1].index.values
-        single_choices = choices[~choices.parcel_id.isin(chosen_multiple)]
-        duplicate_choices = choices[choices.parcel_id.isin(chosen_multiple)]
-        keep_choice = duplicate_choices.parcel_id.drop_duplicates(keep='first')
-        dup_choices_to_keep = duplicate_choices.loc[keep_choice.index]
-        choices = pd.concat([single_choices, dup_choices_to_keep])
-
-        if choices.net_units.sum() >= target_units:
+    keys = _exponential_keys(p, get_rng(rng))
+    codes = _parcel_codes(df)
+    best = _best_per_parcel(keys, codes)
+    positions = _ordered_prefix(keys[best], df.net_units.values[best],
+                                target_units)
+    return df.index.values[best[positions]]
+
+
+def top_profit_choice(df, p, target_units, rng=None):
+    """
+    Deterministic proposal selection that builds the most profitable
+    proposals first until target_units is reached.  Only the proposals
+    needed to reach the target are sorted.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Proposals to select from
+    p : Series
+        Unused, accepted for compatibility with weighted_random_choice
+    target_units: int
+        Number of units to build
+    rng : Generator or int, optional
+        Unused, accepted for compatibility with weighted_random_choice
+
+    Returns
+    -------
+    build_idx : ndarray
+        Index of buildings selected for development
+
+    """
+    keys = _profit_keys(df)
+    positions = _ordered_prefix(keys, df.net_units.values, target_units)
+    return df.index.values[positions]
+
+
+def top_profit_choice_multiparcel(df, p, target_units, rng=None):
+    """
+    Deterministic proposal selection in the context of multiple proposals
+    per parcel.  The most profitable proposal of each parcel is kept, and
+    those are built in order of profit until target_units is reached.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Proposals to select from
+    p : Series
+        Unused, accepted for compatibility with
+        weighted_random_choice_multiparcel
+    target_units: int
+        Number of units to build
+    rng : Generator or int, optional
+        Unused, accepted for compatibility with
+        weighted_random_choice_multiparcel
+
+    Returns
+    -------
+    build_idx : ndarray
+        Index of buildings selected for development
+
+    """
+    keys = _profit_keys(df)
+    codes = _parcel_codes(df)
+    best = _best_per_parcel(keys, codes)
+    positions = _ordered_prefix(keys[best], df.net_units.values[best],
+                                target_units)
+    return df.index.values[best[positions]]
+
+
+# Selection strategies that can be passed to Developer.pick by name, as
+# (one proposal per parcel, multiple proposals per parcel) functions
+SELECTION_METHODS = {
+    'weighted_random': (weighted_random_choice,
+                        weighted_random_choice_multiparcel),
+    'top_profit': (top_profit_choice, top_profit_choice_multiparcel)
+}
+
+
+def weighted_random_joint_choice(df, p, target_units, target_job_spaces,
+                                 rng=None, multiparcel=False):
+    """
+    Weighted random selection against residential and non-residential
+    demand in a single pass.
+
+    Proposals are drawn in the order of their Efraimidis-Spirakis keys, at
+    most one per parcel, and a proposal is built if it adds residential
+    units while residential demand is not yet met, or adds job spaces while
+    non-residential demand is not yet met.  Proposals that add nothing to
+    the open demand are skipped, and their parcel can still be built by a
+    later proposal.  Demand is counted from the positive net units of the
+    proposals built so far.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Proposals to select from, with net_residential_units and
+        net_job_spaces columns
+    p : Series
+        Weights for each proposal
+    target_units : int
+        Number of residential units to build
+    target_job_spaces : int
+        Number of job spaces to build
+    rng : Generator or int, optional
+        Random Generator or seed.  If None, the seed is drawn from NumPy's
+        global random state.
+    multiparcel : bool, optional
+        Whether df holds multiple proposals per parcel, in which case at
+        most one proposal of each parcel is built
+
+    Returns
+    -------
+    build_idx : ndarray
+        Index of buildings selected for development
+
+    """
+    keys = _exponential_keys(p, get_rng(rng))
+    valid = np.flatnonzero(np.isfinite(keys))
+    order = valid[np.argsort(keys[valid], kind='mergesort')]
+    codes = _parcel_codes(df)[order] if multiparcel \
+        else np.arange(len(order))
+
+    units = [df.net_residential_units.values[order].astype('float').clip(0),
+             df.net_job_spaces.values[order].astype('float').clip(0)]
+    targets = [target_units, target_job_spaces]
+    totals = [0., 0.]
+    is_open = [target > 0 for target in targets]
+
+    # The walk is split into phases that end when a demand is met.  Within
+    # a phase every proposal that adds to an open demand is built, unless
+    # its parcel has been built already, so a phase is resolved at once.
+    build = np.zeros(len(order), dtype='bool')
+    used = np.zeros(codes.max() + 1 if len(codes) else 0, dtype='bool')
+    start = 0
+    while any(is_open) and start < len(order):
+        adds = np.zeros(len(order) - start, dtype='bool')
+        for i in np.flatnonzero(is_open):
+            adds |= units[i][start:] > 0
+        candidates = start + np.flatnonzero(adds & ~used[codes[start:]])
+        _, first = np.unique(codes[candidates], return_index=True)
+        candidates = candidates[np.sort(first)]
+        if len(candidates) == 0:
             break
 
-        df = df[~df.parcel_id.isin(choices.parcel_id)]
-        if len(df) == 0:
+        # the phase ends with the proposal that meets an open demand
+        end = len(candidates)
+        for i in np.flatnonzero(is_open):
+            cumulative = totals[i] + units[i][candidates].cumsum()
+            end = min(end, int(np.searchsorted(cumulative, targets[i],
+                                               side="left")) + 1)
+        candidates = candidates[:end]
+
+        build[candidates] = True
+        used[codes[candidates]] = True
+        for i in range(2):
+            totals[i] += units[i][candidates].sum()
+            is_open[i] = is_open[i] and totals[i] < targets[i]
+        start = candidates[-1] + 1
+
+    return df.index.values[order[build]]
+
+
+def weighted_random_replicates(df, p, target_units, rngs,
+                               multiparcel=False, batch_size=16):
+    """
+    Run many replicates of weighted random proposal selection at once.
+
+    Replicate i makes the same selection as weighted_random_choice (or
+    weighted_random_choice_multiparcel) called with rng=rngs[i], but the
+    keys of a batch of replicates are drawn and ordered as one matrix.  As
+    in the single-draw path, np.argpartition selects the prefix of each
+    replicate that is expected to reach the target and only that prefix is
+    sorted.  Memory for the keys is bounded by batch_size rows.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Proposals to select from
+    p : Series
+        Weights for each proposal
+    target_units: int
+        Number of units to build in each replicate
+    rngs : list of Generator
+        One random Generator per replicate
+    multiparcel : bool, optional
+        Whether df holds multiple proposals per parcel, in which case at
+        most one proposal per parcel is selected
+    batch_size : int, optional
+        Number of replicates whose keys are held in memory at a time
+
+    Returns
+    -------
+    selected : ndarray
+        Boolean array of shape (replicates, proposals)
+
+    """
+    n = len(df)
+    selected = np.zeros((len(rngs), n), dtype='bool')
+    if target_units <= 0 or n == 0:
+        return selected
+
+    units = df.net_units.values.astype('float')
+    if not multiparcel and units.sum() < target_units:
+        selected[:] = True
+        return selected
+
+    if multiparcel:
+        codes = _parcel_codes(df)
+        n_codes = codes.max() + 1
+
+    for start in range(0, len(rngs), batch_size):
+        batch = rngs[start:start + batch_size]
+        keys = np.vstack([_exponential_keys(p, rng) for rng in batch])
+
+        if multiparcel:
+            # group-min of the keys of each parcel, in every replicate of
+            # the batch at once
+            flat = codes + n_codes * np.arange(len(batch))[:, None]
+            group_min = np.full(n_codes * len(batch), np.inf)
+            np.minimum.at(group_min, flat.ravel(), keys.ravel())
+            keys[keys > group_min[flat]] = np.inf
+
+        selected[start:start + len(batch)] = _ordered_prefix_rows(
+            keys, units, target_units)
+    return selected
+
+
+class ProposalSampler(object):
+    """
+    Reusable weighted sampler for repeated picks from the same proposals
+    with fixed probabilities, e.g. in replicate studies that run many
+    stochastic realizations of the same year.
+
+    The cumulative sum of the weights is built once, and each draw is a
+    binary search into it.  Draws are made with replacement and a proposal
+    is rejected if its parcel has already been chosen, which gives the same
+    distribution as drawing without replacement.  Chosen parcels are
+    therefore removed lazily, and the cumulative sum is only rebuilt over
+    the remaining proposals when most draws of a batch are rejected.
+    Draws are accepted a block at a time.
+
+    A sample costs time in proportion to the number of proposals it
+    draws rather than the number of proposals, so the sampler is fastest
+    when the target is small compared to the units on offer.  When the
+    target takes up a large share of the proposals, its cost is close to
+    that of weighted_random_choice.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Proposals to select from, with a net_units column
+    p : Series or ndarray
+        Weights for each proposal
+    multiparcel : bool, optional
+        Whether df may hold multiple proposals per parcel.  Only used to
+        decide whether all proposals can be built when there are not enough
+        units to reach the target.
+    parcels : Index, optional
+        Parcel identifiers that the parcel_code column of df refers to.  If
+        df has no parcel_code column, parcels are found by factorizing the
+        parcel_id column or the index of df.
+
+    """
+
+    def __init__(self, df, p, multiparcel=False, parcels=None):
+        self.df = df
+        self.p = p
+        self.multiparcel = multiparcel
+
+        self.codes, self.parcels = _parcel_index(df, parcels)
+
+        self._weights = np.asarray(p, dtype='float')
+        self._units = df.net_units.values.astype('float')
+        self._positions = np.flatnonzero(self._weights > 0)
+        self._cumsum = np.cumsum(self._weights[self._positions])
+
+    def sample(self, target_units, rng=None, parcel_available=None):
+        """
+        Draw proposals until target_units is reached, at most one per
+        parcel.
+
+        Parameters
+        ----------
+        target_units : int
+            Number of units to build
+        rng : Generator or int, optional
+            Random Generator or seed.  If None, the seed is drawn from
+            NumPy's global random state.
+        parcel_available : array-like of bool, optional
+            Availability of each parcel in self.parcels.  Proposals on
+            unavailable parcels are never drawn.
+
+        Returns
+        -------
+        build_idx : ndarray
+            Index of buildings selected for development, in the order they
+            were drawn
+        """
+        rng = get_rng(rng)
+        taken = np.zeros(len(self.parcels), dtype='bool')
+        if parcel_available is not None:
+            taken |= ~np.asarray(parcel_available, dtype='bool')
+
+        positions, cumsum = self._positions, self._cumsum
+        if taken.any():
+            positions, cumsum = self._rebuild(positions, taken)
+
+        if target_units <= 0 or len(positions) == 0:
+            return self.df.index.values[:0]
+
+        if (not self.multiparcel and
+                self._units[positions].sum() < target_units):
+            return self.df.index.values[positions]
+
+        units = self._units
+        mean_units = max(units[positions].mean(), 1)
+        chosen = []
+        tot_units = 0
+        while tot_units < target_units and len(positions) > 0:
+            n = int((target_units - tot_units) / mean_units * 1.2) + 16
+            draws = np.searchsorted(cumsum, rng.random(n) * cumsum[-1],
+                                    side='right')
+            draws = positions[np.minimum(draws, len(positions) - 1)]
+
+            # a draw is accepted if it is the first draw of its parcel in
+            # the block and the parcel was not taken by an earlier block
+            codes = self.codes[draws]
+            _, first = np.unique(codes, return_index=True)
+            first = np.sort(first[~taken[codes[first]]])
+            accepted = draws[first]
+
+            cumulative = tot_units + units[accepted].cumsum()
+            k = int(np.searchsorted(cumulative, target_units,
+                                    side="left")) + 1
+            accepted = accepted[:k]
+            if len(accepted) > 0:
+                taken[self.codes[accepted]] = True
+                chosen.append(accepted)
+                tot_units = cumulative[len(accepted) - 1]
+            if (n - len(first)) * 2 > n:
+                positions, cumsum = self._rebuild(positions, taken)
+
+        if len(chosen) == 0:
+            return self.df.index.values[:0]
+        return self.df.index.values[np.concatenate(chosen)]
+
+    def _rebuild(self, positions, taken):
+        """
+        Drop proposals on taken parcels and rebuild the cumulative sum of
+        the remaining weights.
+        """
+        positions = positions[~taken[self.codes[positions]]]
+        return positions, np.cumsum(self._weights[positions])
+
+
+class PriorityIndex(object):
+    """
+    Proposals ordered by descending profit, for repeated deterministic
+    picks from the same feasibility table within a year.
+
+    Proposals are sorted once.  Each pick walks the order from its head and
+    skips proposals whose parcel is no longer available, and the head is
+    moved past such proposals lazily, so later picks only touch the
+    proposals that are still in play rather than re-sorting the table.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Proposals to select from, with max_profit and net_units columns
+    parcels : Index, optional
+        Parcel identifiers that the parcel_code column of df refers to.  If
+        df has no parcel_code column, parcels are found by factorizing the
+        parcel_id column or the index of df.
+
+    """
+
+    def __init__(self, df, parcels=None):
+        self.df = df
+        self.codes, self.parcels = _parcel_index(df, parcels)
+
+        keys = _profit_keys(df)
+        valid = np.flatnonzero(np.isfinite(keys))
+        self._order = valid[np.argsort(keys[valid], kind='mergesort')]
+        self._units = df.net_units.values.astype('float')
+        self._head = 0
+
+    def __len__(self):
+        return len(self._order) - self._head
+
+    def pop(self, target_units, parcel_available=None, chunk_size=1024):
+        """
+        Return the most profitable proposals, at most one per parcel,
+        until target_units is reached.  If there are not enough units, all
+        available proposals are returned.
+
+        Parameters
+        ----------
+        target_units : int
+            Number of units to build
+        parcel_available : array-like of bool, optional
+            Availability of each parcel in self.parcels.  Proposals on
+            unavailable parcels are skipped, and dropped from the index
+            if they are at its head.
+        chunk_size : int, optional
+            Number of proposals examined at a time
+
+        Returns
+        -------
+        build_idx : ndarray
+            Index of buildings selected for development, in order of
+            profit
+        """
+        taken = np.zeros(len(self.parcels), dtype='bool')
+        if parcel_available is not None:
+            taken |= ~np.asarray(parcel_available, dtype='bool')
+
+        order, codes = self._order, self.codes
+
+        # lazy deletion of unavailable proposals at the head of the index
+        while self._head < len(order):
+            chunk = order[self._head:self._head + chunk_size]
+            alive = np.flatnonzero(~taken[codes[chunk]])
+            if len(alive) > 0:
+                self._head += alive[0]
+                break
+            self._head += len(chunk)
+
+        chosen = []
+        tot_units = 0
+        pos = self._head
+        while tot_units < target_units and pos < len(order):
+            chunk = order[pos:pos + chunk_size]
+            pos += len(chunk)
+            candidates = chunk[~taken[codes[chunk]]]
+            # keep the first, most profitable, proposal of each parcel
+            _, first = np.unique(codes[candidates], return_index=True)
+            candidates = candidates[np.sort(first)]
+
+            cumulative = tot_units + self._units[candidates].cumsum()
+            n = int(np.searchsorted(cumulative, target_units,
+                                    side="left")) + 1
+            candidates = candidates[:n]
+            if len(candidates) > 0:
+                tot_units = cumulative[len(candidates) - 1]
+                taken[codes[candidates]] = True
+                chosen.append(candidates)
+
+        if len(chosen) == 0:
+            return self.df.index.values[:0]
+        return self.df.index.values[np.concatenate(chosen)]
+
+
+def _parcel_index(df, parcels=None):
+    """
+    Return integer parcel codes for a DataFrame of proposals and the parcel
+    identifiers they refer to, from the parcel_code column if parcels are
+    given, or by factorizing the parcel_id column or the index otherwise.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Proposals
+    parcels : Index, optional
+        Parcel identifiers that the parcel_code column of df refers to
+
+    Returns
+    -------
+    codes : ndarray
+    parcels : Index
+    """
+    if 'parcel_code' in df.columns and parcels is not None:
+        return df.parcel_code.values, parcels
+    ids = df.parcel_id.values if 'parcel_id' in df.columns \
+        else df.index.values
+    codes, parcels = pd.factorize(ids)
+    return codes, pd.Index(parcels)
+
+
+def _exponential_keys(p, rng):
+    """
+    Draw Efraimidis-Spirakis keys -log(U) / p for a vector of weights.
+    Sorting the keys in ascending order gives a weighted random sample
+    without replacement.  Proposals with a weight of zero get an infinite
+    key and are never chosen.
+
+    Parameters
+    ----------
+    p : array-like
+        Weights for each proposal
+    rng : Generator
+
+    Returns
+    -------
+    keys : ndarray
+    """
+    p = np.asarray(p, dtype='float')
+    keys = np.full(len(p), np.inf)
+    positive = p > 0
+    keys[positive] = rng.standard_exponential(positive.sum()) / p[positive]
+    return keys
+
+
+def _profit_keys(df):
+    """
+    Ordering keys that put the most profitable proposals first.  Proposals
+    without a profit are never chosen.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Proposals with a max_profit column
+
+    Returns
+    -------
+    keys : ndarray
+    """
+    keys = -df.max_profit.values.astype('float')
+    keys[np.isnan(keys)] = np.inf
+    return keys
+
+
+def _parcel_codes(df):
+    """
+    Return integer parcel codes for a DataFrame of proposals, from the
+    parcel_code column set by the Developer model if it is there, or by
+    factorizing the parcel_id column otherwise.  The parcel_code column
+    numbers every parcel of the model, so it is factorized again when
+    its codes are sparse compared to the proposals in df.  Arrays indexed
+    by code are then at most twice as long as df.
+
+    Parameters
+    ----------
+    df : DataFrame
+        Proposals with a parcel_code or parcel_id column
+
+    Returns
+    -------
+    codes : ndarray
+    """
+    if 'parcel_code' in df.columns:
+        codes = df.parcel_code.values
+        if len(codes) == 0 or codes.max() < 2 * len(codes):
+            return codes
+        return pd.factorize(codes)[0]
+    return pd.factorize(df.parcel_id.values)[0]
+
+
+def _best_per_parcel(keys, codes):
+    """
+    Return the position of the proposal with the smallest key for each
+    parcel, using a vectorized group-min over integer parcel codes.
+    Parcels where every key is infinite are left out.
+
+    Parameters
+    ----------
+    keys : ndarray
+        Ordering keys, smaller keys are better
+    codes : ndarray
+        Non-negative integer parcel code for each proposal, as returned
+        by _parcel_codes
+
+    Returns
+    -------
+    positions : ndarray
+    """
+    if len(keys) == 0:
+        return np.array([], dtype='int')
+
+    group_min = np.full(codes.max() + 1, np.inf)
+    np.minimum.at(group_min, codes, keys)
+    positions = np.flatnonzero((keys == group_min[codes]) & np.isfinite(keys))
+
+    # keep a single proposal per parcel in case of tied keys
+    _, first = np.unique(codes[positions], return_index=True)
+    return positions[np.sort(first)]
+
+
+def _ordered_prefix_rows(keys, units, target_units):
+    """
+    Row-wise version of _ordered_prefix for a matrix of keys with one row
+    per replicate.  Returns a boolean matrix of the proposals in the
+    ordered prefix of each row.
+
+    Parameters
+    ----------
+    keys : ndarray
+        Ordering keys of shape (replicates, proposals)
+    units : ndarray
+        Number of units for each proposal
+    target_units : int
+        Number of units to build
+
+    Returns
+    -------
+    selected : ndarray
+    """
+    n = keys.shape[1]
+    mean_units = units.mean()
+    k = int(target_units / mean_units * 1.5) + 16 if mean_units > 0 else n
+
+    while True:
+        if k < n:
+            prefix = np.argpartition(keys, k, axis=1)[:, :k]
+        else:
+            prefix = np.broadcast_to(np.arange(n), keys.shape)
+        order = np.take_along_axis(prefix, np.argsort(
+            np.take_along_axis(keys, prefix, axis=1), axis=1,
+            kind='mergesort'), axis=1)
+        finite = np.isfinite(np.take_along_axis(keys, order, axis=1))
+        prefix_units = np.where(finite, units[order], 0)
+        tot_units = prefix_units.cumsum(axis=1)
+        # a row is complete if it reaches the target or its prefix already
+        # holds every proposal with a finite key
+        if k >= n or ((tot_units[:, -1] >= target_units) |
+                      ~finite[:, -1]).all():
             break
+        k *= 2
+
+    # keep proposals up to and including the one that reaches the target
+    keep = finite & (tot_units - prefix_units < target_units)
+    selected = np.zeros(keys.shape, dtype='bool')
+    np.put_along_axis(selected, order, keep, axis=1)
+    return selected
+
 
-        p = p.reindex(df.index)
-        p = p / p.sum()
-        new_target = target_units - choices.net_units.sum()
-        next_choice_idx = weighted_random_choice(df, p, new_target)
-        next_choices = df.loc[next_choice_idx]
-        choices = pd.concat([choices, next_choices])
-    return choices.index.values
+def _ordered_prefix(keys, units, target_units):
+    """
+    Return the positions of the proposals with the smallest keys, in
+    ascending key order, up to and including the proposal at which the
+    cumulative units reach target_units.  If there are not enough units,
+    all proposals with a finite key are returned.
+
+    Rather than sorting every key, np.argpartition selects a prefix that is
+    expected to hold enough units and only that prefix is sorted.  The
+    prefix is doubled in the rare case that it falls short.
+
+    Parameters
+    ----------
+    keys : ndarray
+        Ordering keys, smaller keys are chosen first
+    units : ndarray
+        Number of units for each proposal
+    target_units : int
+        Number of units to build
+
+    Returns
+    -------
+    positions : ndarray
+    """
+    valid = np.flatnonzero(np.isfinite(keys))
+    if target_units <= 0 or len(valid) == 0:
+        return np.array([], dtype='int')
+
+    units = np.asarray(units, dtype='float')
+    mean_units = units[valid].mean()
+    k = int(target_units / mean_units * 1.5) + 16 if mean_units > 0 \
+        else len(valid)
+
+    while True:
+        if k < len(valid):
+            prefix = valid[np.argpartition(keys[valid], k)[:k]]
+        else:
+            prefix = valid
+        order = prefix[np.argsort(keys[prefix], kind='mergesort')]
+        tot_units = units[order].cumsum()
+        if tot_units[-1] >= target_units or len(prefix) == len(valid):
+            ind = int(np.searchsorted(tot_units, target_units,
+                                      side="left")) + 1
+            return order[:ind]
+        k *= 2
@@ -0,0 +1,537 @@
+"""
+Local feasibility query service.
+
+Serves pro forma lookups to internal tools from a long-lived process, so
+that imports, configuration parsing and reference table generation are
+paid once rather than on every request.  Warmed SqFtProForma instances are
+kept in a registry keyed by a hash of their configuration, concurrent
+requests for the same configuration and form are coalesced into a single
+vectorized lookup, and request latencies are recorded.
+
+The server speaks a minimal subset of HTTP/1.1 over TCP or a Unix socket,
+using only the standard library::
+
+    python -m developer.service --config proforma.yaml --port 8765
+
+    POST /lookup   {"config": "<hash>", "form": "residential",
+                    "parcels": [{"parcel_id": 1, "residential": 40, ...}]}
+    POST /configs  {"yaml": "<pro forma YAML>"}  or  {"defaults": true}
+    GET  /metrics
+    GET  /health
+
+The FeasibilityService can also be used directly, without a network, by
+awaiting its lookup() and handle() coroutines.
+
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from developer import sqftproforma as sqpf
+
+
+def config_hash(pf):
+    """
+    Return a short, stable hash of the configuration of a SqFtProForma
+    instance.
+
+    Parameters
+    ----------
+    pf : SqFtProForma
+
+    Returns
+    -------
+    str
+    """
+    cfg = json.dumps(pf.to_dict, sort_keys=True, default=_json_default)
+    return hashlib.sha256(cfg.encode('utf-8')).hexdigest()[:16]
+
+
+class ProFormaRegistry(object):
+    """
+    Warmed SqFtProForma instances keyed by the hash of their
+    configuration.  Adding an instance whose configuration is already
+    registered keeps the existing instance.
+    """
+
+    def __init__(self):
+        self._proformas = OrderedDict()
+
+    def add(self, pf):
+        """
+        Register a SqFtProForma instance.
+
+        Parameters
+        ----------
+        pf : SqFtProForma
+
+        Returns
+        -------
+        key : str
+            Configuration hash under which the instance is registered
+        """
+        key = config_hash(pf)
+        self._proformas.setdefault(key, pf)
+        return key
+
+    def add_yaml(self, yaml_str=None, str_or_buffer=None):
+        """
+        Create a SqFtProForma from a YAML configuration and register it.
+
+        Returns
+        -------
+        key : str
+        """
+        return self.add(sqpf.SqFtProForma.from_yaml(yaml_str, str_or_buffer))
+
+    def add_defaults(self):
+        """
+        Register a SqFtProForma with the default configuration.
+
+        Returns
+        -------
+        key : str
+        """
+        return self.add(sqpf.SqFtProForma.from_defaults())
+
+    def get(self, key=None):
+        """
+        Return the SqFtProForma registered under key.  The key may be
+        omitted if exactly one configuration is registered.
+        """
+        if key is None:
+            if len(self._proformas) != 1:
+                raise KeyError('config must be given when {} configurations '
+                               'are registered'.format(len(self._proformas)))
+            return next(iter(self._proformas.values()))
+        return self._proformas[key]
+
+    def keys(self):
+        return list(self._proformas.keys())
+
+    def __contains__(self, key):
+        return key in self._proformas
+
+    def __len__(self):
+        return len(self._proformas)
+
+
+class LatencyMetrics(object):
+    """
+    Keep the most recent latencies of an operation and summarize them.
+
+    Parameters
+    ----------
+    size : int, optional
+        Number of recent latencies kept for the percentiles
+    """
+
+    def __init__(self, size=10000):
+        self.count = 0
+        self.total = 0.
+        self._recent = deque(maxlen=size)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self._recent.append(seconds)
+
+    def summary(self):
+        """
+        Returns
+        -------
+        dict
+            count, and mean, p50, p95, p99 and max latency in milliseconds
+        """
+        if self.count == 0:
+            return {'count': 0}
+        recent = np.array(self._recent) * 1000
+        p50, p95, p99 = np.percentile(recent, [50, 95, 99])
+        return {'count': self.count,
+                'mean_ms': self.total / self.count * 1000,
+                'p50_ms': float(p50),
+                'p95_ms': float(p95),
+                'p99_ms': float(p99),
+                'max_ms': float(recent.max())}
+
+
+class FeasibilityService(object):
+    """
+    Answer pro forma lookups for batches of parcels, coalescing concurrent
+    requests.
+
+    Requests for the same configuration and form that arrive within
+    batch_window seconds of each other are concatenated and run through a
+    single SqFtProForma.lookup call in a worker thread, and identical
+    requests that are in flight at the same time share one answer.  If the
+    lookup of a batch fails, its requests are run one by one, so that only
+    the requests that cause the error fail.
+
+    Parameters
+    ----------
+    registry : ProFormaRegistry, optional
+        Registry of warmed pro formas.  A new, empty registry is created if
+        None.
+    batch_window : float, optional
+        Seconds to wait for more requests before running a batch
+    max_batch_rows : int, optional
+        A batch is run right away once it holds this many parcels
+    max_workers : int, optional
+        Number of threads running lookups
+
+    """
+
+    def __init__(self, registry=None, batch_window=0.002,
+                 max_batch_rows=50000, max_workers=1):
+        self.registry = ProFormaRegistry() if registry is None else registry
+        self.batch_window = batch_window
+        self.max_batch_rows = max_batch_rows
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+        self._pending = {}
+        self._inflight = {}
+
+        self.request_latency = LatencyMetrics()
+        self.batch_latency = LatencyMetrics()
+        self.counters = OrderedDict([('requests', 0), ('coalesced', 0),
+                                     ('batches', 0), ('parcels', 0),
+                                     ('errors', 0)])
+
+    async def lookup(self, form, parcels, config=None):
+        """
+        Run the pro forma lookup for a list of parcels.
+
+        Parameters
+        ----------
+        form : str
+            Form to look up
+        parcels : list of dict
+            One record per parcel with the columns expected by
+            SqFtProForma.lookup, and optionally a parcel_id, which must
+            then be given for every parcel
+        config : str, optional
+            Configuration hash of a registered pro forma.  May be omitted
+            if a single configuration is registered.
+
+        Returns
+        -------
+        results : list of dict
+            One record per feasible proposal, with the parcel_id (or the
+            position of the parcel in parcels if no parcel_id was given)
+        """
+        start = time.perf_counter()
+        self.counters['requests'] += 1
+        pf = self.registry.get(config)
+
+        has_ids = {'parcel_id' in record for record in parcels}
+        if len(has_ids) > 1:
+            raise ValueError('parcel_id must be given for all parcels of a '
+                             'request or for none')
+
+        key = (id(pf), form,
+               json.dumps(parcels, sort_keys=True, default=_json_default))
+        future = self._inflight.get(key)
+        if future is not None:
+            self.counters['coalesced'] += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._inflight.pop(key, None))
+            self._enqueue(pf, form, parcels, future, True in has_ids)
+
+        try:
+            return await asyncio.shield(future)
+        finally:
+            self.request_latency.add(time.perf_counter() - start)
+
+    def _enqueue(self, pf, form, parcels, future, has_ids):
+        # requests with and without parcel ids are batched separately
+        group = (id(pf), form, has_ids)
+        batch = self._pending.get(group)
+        if batch is None:
+            batch = self._pending[group] = {'pf': pf, 'form': form,
+                                            'requests': [], 'rows': 0}
+            asyncio.get_running_loop().call_later(
+                self.batch_window, self._flush, group, batch)
+        batch['requests'].append((parcels, future))
+        batch['rows'] += len(parcels)
+        if batch['rows'] >= self.max_batch_rows:
+            self._flush(group, batch)
+
+    def _flush(self, group, batch):
+        if self._pending.get(group) is not batch:
+            # already flushed because it was full
+            return
+        del self._pending[group]
+        asyncio.ensure_future(self._run_batch(batch))
+
+    async def _run_batch(self, batch):
+        requests = batch['requests']
+        start = time.perf_counter()
+        try:
+            try:
+                results = await self._run_lookup(
+                    batch, [parcels for parcels, _ in requests])
+            except Exception as e:
+                if len(requests) == 1:
+                    results = [e]
+                else:
+                    # run the requests one by one so that only the ones
+                    # that cause the error fail
+                    results = []
+                    for parcels, _ in requests:
+                        try:
+                            results += await self._run_lookup(batch,
+                                                              [parcels])
+                        except Exception as e:
+                            results.append(e)
+
+            for (_, future), result in zip(requests, results):
+                if future.done():
+                    continue
+                if isinstance(result, Exception):
+                    self.counters['errors'] += 1
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            self.batch_latency.add(time.perf_counter() - start)
+
+    async def _run_lookup(self, batch, requests):
+        """
+        Run the lookup of a batch for the parcels of a list of requests in
+        a worker thread, and split the results by request.
+
+        Parameters
+        ----------
+        batch : dict
+            Batch with the pro forma and form to look up
+        requests : list of list of dict
+            Parcel records of each request
+
+        Returns
+        -------
+        results : list of list of dict
+            Result records of each request
+        """
+        df = pd.DataFrame.from_records(
+            [record for parcels in requests for record in parcels])
+        parcel_ids = df.pop('parcel_id').values \
+            if 'parcel_id' in df.columns else None
+        offsets = np.cumsum([0] + [len(parcels) for parcels in requests])
+
+        result = await asyncio.get_running_loop().run_in_executor(
+            self._executor, batch['pf'].lookup, batch['form'], df)
+
+        self.counters['batches'] += 1
+        self.counters['parcels'] += len(df)
+        positions = result.index.values if len(result) else \
+            np.array([], dtype='int')
+        bounds = np.searchsorted(offsets, positions, side='right') - 1
+        results = []
+        for i in range(len(requests)):
+            rows = result[bounds == i]
+            if parcel_ids is not None:
+                ids = parcel_ids[rows.index.values]
+            else:
+                ids = rows.index.values - offsets[i]
+            records = _records(rows)
+            for record, parcel_id in zip(records, ids):
+                record['parcel_id'] = parcel_id
+            results.append(records)
+        return results
+
+    def metrics(self):
+        """
+        Returns
+        -------
+        dict
+            Counters and request and batch latency summaries
+        """
+        return {'counters': dict(self.counters),
+                'request_latency': self.request_latency.summary(),
+                'batch_latency': self.batch_latency.summary(),
+                'configs': self.registry.keys()}
+
+    async def handle(self, method, path, body=None):
+        """
+        Handle one request of the HTTP interface.
+
+        Parameters
+        ----------
+        method : str
+            "GET" or "POST"
+        path : str
+        body : dict, optional
+            Decoded JSON body.  POST requests need a JSON object.
+
+        Returns
+        -------
+        status : int
+            HTTP status code
+        payload : dict
+        """
+        try:
+            if method == 'GET' and path == '/health':
+                return 200, {'status': 'ok', 'configs': self.registry.keys()}
+            if method == 'GET' and path == '/metrics':
+                return 200, self.metrics()
+            if (method == 'POST' and path in ('/configs', '/lookup') and
+                    not isinstance(body, dict)):
+                return 400, {'error': 'malformed request'}
+            if method == 'POST' and path == '/configs':
+                if body.get('defaults'):
+                    key = self.registry.add_defaults()
+                else:
+                    key = self.registry.add_yaml(yaml_str=body['yaml'])
+                return 200, {'config': key}
+            if method == 'POST' and path == '/lookup':
+                results = await self.lookup(body['form'], body['parcels'],
+                                            body.get('config'))
+                return 200, {'results': results}
+        except KeyError as e:
+            return 400, {'error': 'missing or unknown key: {}'.format(e)}
+        except (ValueError, TypeError, AssertionError) as e:
+            return 400, {'error': str(e)}
+        except Exception as e:
+            return 500, {'error': '{}: {}'.format(type(e).__name__, e)}
+        return 404, {'error': 'not found: {} {}'.format(method, path)}
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            request = await read_request(reader)
+            if request is None:
+                status, payload = 400, {'error': 'malformed request'}
+            else:
+                status, payload = await self.handle(*request)
+            body = json.dumps(payload, default=_json_default).encode('utf-8')
+            writer.write(
+                'HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n'
+                'Content-Length: {}\r\nConnection: close\r\n\r\n'.format(
+                    status, _REASONS.get(status, ''), len(body))
+                .encode('latin-1') + body)
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765, path=None):
+        """
+        Start serving HTTP on a TCP port, or on a Unix socket if path is
+        given.
+
+        Returns
+        -------
+        server : asyncio.Server
+        """
+        if path is not None:
+            return await asyncio.start_unix_server(self._handle_connection,
+                                                   path=path)
+        return await asyncio.start_server(self._handle_connection, host,
+                                          port)
+
+
+_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+            500: 'Internal Server Error'}
+
+
+async def read_request(reader):
+    """
+    Read one HTTP request from an asyncio StreamReader.
+
+    Returns
+    -------
+    None if the request cannot be parsed (including a Content-Length that
+    is not a non-negative integer), or (method, path, body) with the JSON
+    body decoded (None if empty)
+    """
+    request_line = await reader.readline()
+    parts = request_line.decode('latin-1').split()
+    if len(parts) < 2:
+        return None
+    method, path = parts[0].upper(), parts[1]
+
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.strip().lower() == 'content-length':
+            try:
+                length = int(value.strip())
+            except ValueError:
+                return None
+            if length < 0:
+                return None
+
+    body = None
+    if length > 0:
+        try:
+            body = json.loads((await reader.readexactly(length))
+                              .decode('utf-8'))
+        except ValueError:
+            return None
+    return method, path, body
+
+
+def _records(df):
+    """
+    Convert a DataFrame into a list of dicts of plain Python values, with
+    missing values as None.
+    """
+    return df.astype('object').where(df.notnull(), None).to_dict('records')
+
+
+def _json_default(obj):
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError('{!r} is not JSON serializable'.format(obj))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve pro forma feasibility lookups')
+    parser.add_argument('--config', nargs='*', default=[],
+                        help='pro forma YAML configuration files to load')
+    parser.add_argument('--defaults', action='store_true',
+                        help='also load the default pro forma')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--unix', help='serve on this Unix socket path')
+    parser.add_argument('--batch-window', type=float, default=0.002,
+                        help='seconds to wait to coalesce requests')
+    args = parser.parse_args(argv)
+
+    service = FeasibilityService(batch_window=args.batch_window)
+    for path in args.config:
+        print('loaded {} as {}'.format(
+            path, service.registry.add_yaml(str_or_buffer=path)))
+    if args.defaults or len(service.registry) == 0:
+        print('loaded defaults as {}'.format(
+            service.registry.add_defaults()))
+
+    async def run():
+        server = await service.serve(args.host, args.port, args.unix)
+        print('serving on {}'.format(
+            args.unix or '{}:{}'.format(args.host, args.port)))
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
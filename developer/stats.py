@@ -0,0 +1,139 @@
+import time
+from collections import OrderedDict
+
+
+class Stats(object):
+    """
+    Lightweight instrumentation for the pro forma lookup and the Developer
+    model.  Records the wall time spent in each stage (including the
+    user-supplied modify_* and selection hooks) and the number of rows
+    left or dropped at each filter.
+
+    Attach an instance to a pro forma with ``pf.stats = Stats()`` or pass
+    it to the Developer model with ``Developer(..., stats=Stats())``.  Both
+    default to NULL_STATS, which records nothing and adds next to no
+    overhead.
+
+    Stage and counter names are dotted, e.g. "lookup.parking_cfg" or
+    "pick.max_parcel_size".  Repeated stages and counters accumulate, so a
+    single Stats object can collect a whole simulation year; call reset()
+    to start over.
+
+    Parameters
+    ----------
+    callback : function, optional
+        Called as callback(kind, name, value) for every record, where kind
+        is "time" (value in seconds) or "count", e.g. to forward records
+        to a metrics pipeline as they happen.
+
+    """
+
+    enabled = True
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.reset()
+
+    def reset(self):
+        """Forget all recorded timings and counts"""
+        self.timings = OrderedDict()
+        self.calls = OrderedDict()
+        self.counts = OrderedDict()
+
+    def timer(self, name):
+        """
+        Return a context manager that adds the wall time spent in its
+        block to the stage called name.
+        """
+        return _Timer(self, name)
+
+    def add_time(self, name, seconds):
+        """Add seconds to the time spent in the stage called name"""
+        self.timings[name] = self.timings.get(name, 0.) + seconds
+        self.calls[name] = self.calls.get(name, 0) + 1
+        if self.callback is not None:
+            self.callback('time', name, seconds)
+
+    def count(self, name, n):
+        """Add n to the counter called name"""
+        n = int(n)
+        self.counts[name] = self.counts.get(name, 0) + n
+        if self.callback is not None:
+            self.callback('count', name, n)
+
+    def to_dict(self):
+        """
+        Return the recorded statistics as a dictionary of plain Python
+        types, ready to be serialized, e.g. as JSON.
+
+        Returns
+        -------
+        dict
+            With "timings" (seconds per stage), "calls" (number of times
+            each stage ran) and "counts" keys
+        """
+        return {'timings': dict(self.timings),
+                'calls': dict(self.calls),
+                'counts': dict(self.counts)}
+
+    def __repr__(self):
+        lines = ['{:<40} {:10.4f}s {:>6}x'.format(
+            name, seconds, self.calls[name])
+            for name, seconds in self.timings.items()]
+        lines += ['{:<40} {:>10}'.format(name, n)
+                  for name, n in self.counts.items()]
+        return '\n'.join(['Stats'] + lines)
+
+
+class _Timer(object):
+    __slots__ = ('stats', 'name', 'start')
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.stats.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class NullStats(object):
+    """
+    Stats that record nothing, used when instrumentation is disabled.
+    """
+
+    enabled = False
+    _timer = _NullTimer()
+
+    def reset(self):
+        pass
+
+    def timer(self, name):
+        return self._timer
+
+    def add_time(self, name, seconds):
+        pass
+
+    def count(self, name, n):
+        pass
+
+    def to_dict(self):
+        return {'timings': {}, 'calls': {}, 'counts': {}}
+
+
+# Shared instance used as the default when instrumentation is disabled
+NULL_STATS = NullStats()
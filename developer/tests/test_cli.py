@@ -0,0 +1,148 @@
+import json
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+from developer import cli
+from developer import sqftproforma as sqpf
+
+
+@pytest.fixture
+def run_files(tmpdir):
+    parcels = pd.DataFrame(
+        {'parcel_id': [10, 11, 12, 13, 14],
+         'residential': [40, 40, 40, 60, 50],
+         'office': [15, 18, 15, 20, 25],
+         'retail': [12, 10, 10, 14, 16],
+         'industrial': [12, 12, 12, 12, 12],
+         'land_cost': [1000000, 2000000, 3000000, 500000, 800000],
+         'parcel_size': [10000, 20000, 30000, 15000, 12000],
+         'max_far': [2.0, 3.0, 0.0, 4.0, 1.5],
+         'max_height': [40, 60, 80, 90, 30]})
+    parcels_path = str(tmpdir.join('parcels.csv'))
+    parcels.to_csv(parcels_path, index=False)
+    config = str(tmpdir.join('proforma.yaml'))
+    pf = sqpf.SqFtProForma.from_defaults()
+    pf.forms_to_test = ['residential', 'office']
+    pf.to_yaml(config)
+    return config, parcels_path, str(tmpdir.join('out')), parcels
+
+
+def read_output(output, form):
+    directory = os.path.join(output, 'form={}'.format(form))
+    return pd.concat([pd.read_csv(os.path.join(directory, name),
+                                  index_col='parcel_id')
+                      for name in sorted(os.listdir(directory))])
+
+
+def test_cli_run(run_files):
+    config, parcels_path, output, parcels = run_files
+    messages = []
+    stats = cli.run(config, parcels_path, output, chunk_size=2, fmt='csv',
+                    index_col='parcel_id', log=messages.append)
+
+    pf = sqpf.SqFtProForma.from_yaml(str_or_buffer=config)
+    for form in ['residential', 'office']:
+        expected = pf.lookup(form, parcels.set_index('parcel_id'))
+        result = read_output(output, form)
+        assert list(result.index) == list(expected.index)
+        assert (result.max_profit.values ==
+                pytest.approx(expected.max_profit.values))
+
+    # three chunks for two forms
+    assert len(os.listdir(os.path.join(output, '_markers'))) == 6
+    assert stats.counts['parcels'] == 5
+    assert stats.calls['lookup'] == 6
+    with open(os.path.join(output, '_stats.json')) as f:
+        assert json.load(f)['counts']['lookup.parcels'] == 10
+
+    # a second run skips completed chunks and recomputes missing ones
+    os.remove(cli.marker_path(output, 'office', 1))
+    stats = cli.run(config, parcels_path, output, chunk_size=2, fmt='csv',
+                    index_col='parcel_id', log=messages.append)
+    assert stats.calls['lookup'] == 1
+    assert 'skipped' in messages[-1]
+
+    with pytest.raises(ValueError):
+        cli.run(config, parcels_path, output, chunk_size=3, fmt='csv',
+                index_col='parcel_id', log=messages.append)
+
+
+def test_cli_rerun_leaves_no_stale_parts(run_files):
+    config, parcels_path, output, parcels = run_files
+    cli.run(config, parcels_path, output, chunk_size=2, fmt='csv',
+            index_col='parcel_id', log=lambda message: None)
+
+    # a fresh run with another chunk size replaces the earlier parts
+    cli.run(config, parcels_path, output, chunk_size=3, fmt='csv',
+            index_col='parcel_id', resume=False, log=lambda message: None)
+    pf = sqpf.SqFtProForma.from_yaml(str_or_buffer=config)
+    expected = pf.lookup('residential', parcels.set_index('parcel_id'))
+    result = read_output(output, 'residential')
+    assert list(result.index) == list(expected.index)
+    assert len(os.listdir(os.path.join(output, '_markers'))) == 4
+
+    # a recomputed chunk without feasible proposals removes its old part
+    parcels.loc[3:, 'max_far'] = 0.
+    parcels.to_csv(parcels_path, index=False)
+    cli.run(config, parcels_path, output, chunk_size=3, fmt='csv',
+            index_col='parcel_id', resume=False, log=lambda message: None)
+    shutil.copy(cli.part_path(output, 'residential', 0, 'csv'),
+                cli.part_path(output, 'residential', 1, 'csv'))
+    os.remove(cli.marker_path(output, 'residential', 1))
+    cli.run(config, parcels_path, output, chunk_size=3, fmt='csv',
+            index_col='parcel_id', log=lambda message: None)
+    assert not os.path.exists(
+        cli.part_path(output, 'residential', 1, 'csv'))
+    assert set(read_output(output, 'residential').index) <= {10, 11, 12}
+
+
+def test_cli_resume_rejects_changed_parcels(run_files):
+    config, parcels_path, output, parcels = run_files
+    cli.run(config, parcels_path, output, chunk_size=2, fmt='csv',
+            index_col='parcel_id', log=lambda message: None)
+
+    # the parcel file is regenerated at the same path
+    parcels.land_cost *= 10
+    parcels.to_csv(parcels_path, index=False)
+    with pytest.raises(ValueError):
+        cli.run(config, parcels_path, output, chunk_size=2, fmt='csv',
+                index_col='parcel_id', log=lambda message: None)
+
+    cli.run(config, parcels_path, output, chunk_size=2, fmt='csv',
+            index_col='parcel_id', resume=False, log=lambda message: None)
+    pf = sqpf.SqFtProForma.from_yaml(str_or_buffer=config)
+    expected = pf.lookup('residential', parcels.set_index('parcel_id'))
+    result = read_output(output, 'residential')
+    assert (result.max_profit.values ==
+            pytest.approx(expected.max_profit.values))
+
+
+def test_cli_workers(run_files):
+    config, parcels_path, output, parcels = run_files
+    cli.main(['--config', config, '--parcels', parcels_path,
+              '--output', output, '--chunk-size', '2', '--workers', '2',
+              '--format', 'csv', '--index-col', 'parcel_id'])
+    pf = sqpf.SqFtProForma.from_yaml(str_or_buffer=config)
+    expected = pf.lookup('residential', parcels.set_index('parcel_id'))
+    assert list(read_output(output, 'residential').index) == \
+        list(expected.index)
+
+
+def test_cli_parquet(run_files, tmpdir):
+    pytest.importorskip('pyarrow')
+    from developer.feasibility import read_feasibility
+    config, _, output, parcels = run_files
+    parcels_path = str(tmpdir.join('parcels.parquet'))
+    parcels.to_parquet(parcels_path, index=False)
+    cli.run(config, parcels_path, output, chunk_size=2,
+            index_col='parcel_id', log=lambda message: None)
+
+    pf = sqpf.SqFtProForma.from_yaml(str_or_buffer=config)
+    result = read_feasibility(output)
+    assert list(result.keys()) == ['office', 'residential']
+    for form, df in result.items():
+        expected = pf.lookup(form, parcels.set_index('parcel_id'))
+        assert sorted(df.index) == sorted(expected.index)
@@ -1,10 +1,12 @@
 from __future__ import print_function, division, absolute_import
+import numpy as np
 import pandas as pd
 import pytest
 import os
 
 from developer import sqftproforma as sqpf
 from developer import develop
+from developer import utils
 
 
 @pytest.fixture
@@ -156,3 +158,288 @@ def test_developer_yaml_roundtrip(res10):
 def test_developer_compute_forms_max_profit(res10):
     dev = develop.Developer(**res10)
     dev.keep_form_with_max_profit()
+
+
+def test_keep_form_with_max_profit_layout(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    simple_dev_inputs.land_cost /= 100
+    feasibility = {form: pf.lookup(form, simple_dev_inputs)
+                   for form in ['office', 'residential', 'industrial']}
+    feasibility['office'] = feasibility['office'].iloc[:2]
+    forms = list(feasibility.keys())
+
+    dev = develop.Developer(feasibility, forms, 10,
+                            simple_dev_inputs.parcel_size,
+                            simple_dev_inputs.parcel_size * 0 + 650,
+                            simple_dev_inputs.parcel_size * 0)
+    df = dev.keep_form_with_max_profit(forms)
+
+    assert df.index.name == 'parcel_id'
+    assert list(df.index) == ['a', 'b', 'c']
+    assert list(df.columns) == (['form'] +
+                                list(feasibility['residential'].columns))
+    for parcel_id, row in df.iterrows():
+        profits = {form: feasibility[form].max_profit.get(parcel_id)
+                   for form in forms}
+        best = max((p, form) for form, p in profits.items()
+                   if p is not None)[1]
+        assert row.form == best
+        assert row.max_profit == feasibility[best].max_profit[parcel_id]
+
+    assert len(dev.keep_form_with_max_profit(['office'])) == 2
+
+
+def test_developer_pick_reproducible(res, res_multi_proposals):
+    picks = []
+    for seed in [1, 1, 2]:
+        dev = develop.Developer(target_units=10, **res)
+        picks.append(dev.pick(rng=seed).parcel_id.tolist())
+    assert picks[0] == picks[1]
+
+    picks = []
+    for seed in [1, 1]:
+        dev = develop.Developer(target_units=20, keep_suboptimal=True,
+                                **res_multi_proposals)
+        picks.append(dev.pick(rng=seed).parcel_id.tolist())
+    assert picks[0] == picks[1]
+
+
+def test_developer_partitioned_targets(simple_dev_inputs, base_args):
+    simple_dev_inputs['submarket'] = ['north', 'north', 'south']
+    pf = sqpf.SqFtProForma.from_defaults()
+    pf.pass_through = ['submarket']
+    args = base_args.copy()
+    args['feasibility'] = {
+        'residential': pf.lookup('residential', simple_dev_inputs)}
+
+    targets = pd.DataFrame({'target_units': [1, 1, 5]},
+                           index=['north', 'south', 'east'])
+    dev = develop.Developer(forms='residential', target_units=targets,
+                            partition_col='submarket', **args)
+    bldgs = dev.pick(rng=0)
+    assert sorted(bldgs.submarket) == ['north', 'south']
+    assert 'c' in bldgs.parcel_id.values
+
+    targets = pd.DataFrame({'target_units': [0, 5]},
+                           index=['north', 'south'])
+    dev = develop.Developer(forms='residential', target_units=targets,
+                            partition_col='submarket', **args)
+    bldgs = dev.pick(rng=0)
+    assert list(bldgs.parcel_id) == ['c']
+
+    # results do not depend on the number of threads
+    targets = pd.DataFrame({'target_units': [1, 1]},
+                           index=['north', 'south'])
+    picks = []
+    for n_jobs in [1, 2]:
+        dev = develop.Developer(forms='residential', target_units=targets,
+                                partition_col='submarket', **args)
+        picks.append(dev.pick(rng=3, n_jobs=n_jobs).parcel_id.tolist())
+    assert picks[0] == picks[1]
+
+
+def test_developer_top_profit(res, res_multi_proposals):
+    dev = develop.Developer(target_units=10, **res)
+    bldgs = dev.pick(selection_method='top_profit')
+    assert list(bldgs.parcel_id) == ['c']
+
+    dev = develop.Developer(target_units=10, keep_suboptimal=True,
+                            **res_multi_proposals)
+    bldgs = dev.pick(selection_method='top_profit')
+    assert list(bldgs.parcel_id) == ['c']
+    assert bldgs.max_profit[0] == \
+        res_multi_proposals['feasibility'].max_profit['c'].max()
+
+
+def test_developer_mask_after_build(res, res_multi_proposals):
+    dev = develop.Developer(target_units=10, mask_after_build=True, **res)
+    feasibility = dev.feasibility
+    first = dev.pick()
+    assert len(first) == 1
+    assert dev.feasibility is feasibility
+    assert dev.available.sum() == 2
+    assert not dev.parcel_available[
+        dev.parcels.get_loc(first.parcel_id[0])]
+
+    second = dev.pick()
+    assert first.parcel_id[0] not in second.parcel_id.values
+
+    dev.mark_unavailable(['a', 'b', 'c', 'not_a_parcel'])
+    assert dev.pick() is None
+
+    # masks carry over when the feasibility table is replaced
+    dev.feasibility = res['feasibility']['residential'].copy()
+    assert dev.parcel_available.sum() == 0
+
+    # built parcels are masked in the long format
+    args = res_multi_proposals.copy()
+    args.update({key: res[key] for key in
+                 ['parcel_size', 'ave_unit_size', 'current_units']})
+    dev = develop.Developer(target_units=10, keep_suboptimal=True, **args)
+    first = dev.pick()
+    assert dev.available.sum() == 6
+    second = dev.pick()
+    assert first.parcel_id[0] not in second.parcel_id.values
+
+
+def test_developer_parcel_attributes(res):
+    args = res.copy()
+    args['ave_unit_size'] = pd.Series([650, 300, 650], index=['c', 'a', 'b'])
+    dev = develop.Developer(target_units=10, mask_after_build=True, **args)
+    attributes = dev._parcel_attributes()
+    assert list(dev.parcels) == ['a', 'b', 'c']
+    assert list(attributes['ave_unit_size']) == [400, 650, 650]
+    # the caller's series is not modified
+    assert args['ave_unit_size']['a'] == 300
+
+    dev.pick()
+    assert dev._parcel_attributes() is attributes
+    dev.min_unit_size = 200
+    assert dev._parcel_attributes()['ave_unit_size'][0] == 300
+
+
+def test_developer_parcel_map_survives_drops(res):
+    dev = develop.Developer(target_units=10, **res)
+    parcels = dev.parcels
+    attributes = dev._parcel_attributes()
+    first = dev.pick(rng=0)
+    # the built parcel is dropped from the table and tombstoned, without
+    # renumbering parcels or regathering their attributes
+    assert len(dev.feasibility) == 2
+    assert dev.parcels is parcels
+    assert dev._parcel_attributes() is attributes
+    assert not dev.parcel_available[parcels.get_loc(first.parcel_id[0])]
+    second = dev.pick(rng=0)
+    assert first.parcel_id[0] not in second.parcel_id.values
+    assert dev.parcels is parcels
+
+
+def test_developer_restores_parcel_labels(res, res_multi_proposals):
+    dev = develop.Developer(target_units=1000, **res)
+    bldgs = dev.pick()
+    assert sorted(bldgs.parcel_id) == ['a', 'b', 'c']
+    assert 'parcel_code' not in bldgs.columns
+
+    dev = develop.Developer(target_units=1000, keep_suboptimal=True,
+                            **res_multi_proposals)
+    bldgs = dev.pick()
+    assert sorted(bldgs.parcel_id) == ['a', 'b', 'c']
+    assert 'parcel_code' not in bldgs.columns
+
+
+def test_developer_pick_with_sampler(res, res_multi_proposals):
+    dev = develop.Developer(target_units=10, **res)
+    sampler = dev.build_sampler()
+    first = dev.pick(sampler=sampler, rng=0)
+    assert len(first) == 1
+    assert len(dev.feasibility) == 2
+    # parcels dropped from the feasibility table are not drawn again
+    second = dev.pick(sampler=sampler, rng=0)
+    assert len(second) == 1
+    assert first.parcel_id[0] not in second.parcel_id.values
+
+    picks = []
+    for seed in [5, 5]:
+        dev = develop.Developer(target_units=10, **res)
+        picks.append(dev.pick(sampler=dev.build_sampler(),
+                              rng=seed).parcel_id.tolist())
+    assert picks[0] == picks[1]
+
+    dev = develop.Developer(target_units=20, keep_suboptimal=True,
+                            **res_multi_proposals)
+    sampler = dev.build_sampler()
+    built = dev.pick(sampler=sampler, rng=0).parcel_id.tolist()
+    dev.target_units = 1000
+    built += dev.pick(sampler=sampler).parcel_id.tolist()
+    assert sorted(built) == ['a', 'b', 'c']
+    assert len(dev.pick(sampler=sampler)) == 0
+
+
+def test_developer_pick_replicates(res, res_multi_proposals):
+    dev = develop.Developer(target_units=10, **res)
+    df, selected = dev.pick_replicates(50, seed=0)
+    assert selected.shape == (50, len(df))
+    assert (selected.sum(axis=1) == 1).all()
+    assert len(dev.feasibility) == 3
+
+    rngs = utils.spawn_rngs(0, 50)
+    for i in [0, 17]:
+        bldgs = develop.Developer(target_units=10, **res).pick(rng=rngs[i])
+        assert list(df.index[selected[i]]) == list(bldgs.parcel_id)
+
+    freq = dev.pick_replicates(50, seed=0, frequencies=True)
+    assert freq.index.name == 'parcel_id'
+    assert abs(freq.sum() - 1) < 1e-9
+
+    dev = develop.Developer(target_units=1000, keep_suboptimal=True,
+                            **res_multi_proposals)
+    freq = dev.pick_replicates(10, seed=0, frequencies=True)
+    assert sorted(freq.index) == ['a', 'b', 'c']
+    assert (freq == 1).all()
+
+
+def test_developer_pick_joint(simple_dev_inputs, base_args):
+    simple_dev_inputs['residential'] = [40, 40, 10]
+    simple_dev_inputs['office'] = [15, 15, 40]
+    simple_dev_inputs.land_cost /= 100
+    pf = sqpf.SqFtProForma.from_defaults()
+    args = base_args.copy()
+    args['feasibility'] = {form: pf.lookup(form, simple_dev_inputs)
+                           for form in ['residential', 'office']}
+    current_job_spaces = pd.Series([0, 0, 5], index=['a', 'b', 'c'])
+
+    dev = develop.Developer(forms=['residential', 'office'],
+                            target_units=1, **args)
+    bldgs = dev.pick_joint(1, current_job_spaces, rng=0)
+    assert sorted(bldgs.form) == ['office', 'residential']
+    assert 'c' in bldgs.parcel_id.values
+    assert bldgs.net_job_spaces.max() == bldgs.job_spaces.max() - 5
+    assert len(dev.feasibility) == 1
+
+    # the remaining parcel is only residential
+    bldgs = dev.pick_joint(1000, current_job_spaces, rng=0)
+    assert list(bldgs.form) == ['residential']
+    assert dev.pick_joint(1000, current_job_spaces) is None
+
+
+def test_developer_priority_index(res, res_multi_proposals):
+    dev = develop.Developer(target_units=10, priority_index=True, **res)
+    assert list(dev.pick(selection_method='top_profit').parcel_id) == ['c']
+    cache = dev._proposal_cache
+    assert list(dev.pick(selection_method='top_profit').parcel_id) == ['b']
+    assert dev._proposal_cache is cache
+    assert dev.pick(rng=0).parcel_id[0] == 'a'
+    assert dev.pick() is None
+
+    dev = develop.Developer(target_units=10, keep_suboptimal=True,
+                            priority_index=True, **res_multi_proposals)
+    built = []
+    for _ in range(3):
+        built += dev.pick(selection_method='top_profit').parcel_id.tolist()
+    assert built == ['c', 'b', 'a']
+
+
+def test_developer_priority_index_remaining_units(res, capsys):
+    # the parcel built by the first pick no longer counts towards the
+    # units on offer of the second
+    for method in ['top_profit', 'weighted_random']:
+        dev = develop.Developer(target_units=10, priority_index=True, **res)
+        dev.pick(selection_method='top_profit')
+        capsys.readouterr()
+        dev.target_units = dev._proposal_cache[1][0].net_units.sum() - 1
+        dev.pick(selection_method=method)
+        assert 'NOT ENOUGH PROFITABLE UNITS' in capsys.readouterr().out
+
+
+def test_developer_priority_index_custom_selection(res):
+    def random_choice(self, df, p, target_units):
+        return np.random.choice(df.index.values, size=1, replace=False,
+                                p=p)
+
+    dev = develop.Developer(target_units=10, priority_index=True, **res)
+    built = []
+    for _ in range(3):
+        bldgs = dev.pick(custom_selection_func=random_choice)
+        built += bldgs.parcel_id.tolist()
+    assert sorted(built) == ['a', 'b', 'c']
+    assert dev.pick(custom_selection_func=random_choice) is None
@@ -0,0 +1,189 @@
+import pandas as pd
+import pytest
+
+from developer import sqftproforma as sqpf
+from developer import develop
+from developer.feasibility import FeasibilityCube, FeasibilityStore, \
+    to_parquet, read_feasibility
+
+
+@pytest.fixture
+def low_cost_inputs():
+    return pd.DataFrame(
+        {'residential': [40, 40, 40],
+         'office': [15, 18, 15],
+         'retail': [12, 10, 10],
+         'industrial': [12, 12, 12],
+         'land_cost': [10000, 20000, 30000],
+         'parcel_size': [10000, 20000, 30000],
+         'max_far': [2.0, 3.0, 4.0],
+         'max_height': [40, 60, 80]},
+        index=['a', 'b', 'c'])
+
+
+@pytest.fixture
+def feasibility_dict(low_cost_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    d = {form: pf.lookup(form, low_cost_inputs)
+         for form in ['residential', 'office', 'industrial']}
+    # make one form infeasible on one parcel
+    d['office'] = d['office'].iloc[:2]
+    return d
+
+
+@pytest.fixture
+def parcel_args(low_cost_inputs):
+    index = low_cost_inputs.index
+    return {'parcel_size': pd.Series(1000, index=index),
+            'ave_unit_size': pd.Series(650, index=index),
+            'current_units': pd.Series(0, index=index)}
+
+
+def test_cube_roundtrip(feasibility_dict):
+    cube = FeasibilityCube.from_dict(feasibility_dict)
+    assert cube.shape == (3, 3, 13)
+    assert 'parking_config' in cube.labels
+
+    wide = pd.concat(feasibility_dict.values(),
+                     keys=feasibility_dict.keys(), axis=1)
+    pd.testing.assert_frame_equal(cube.to_frame(), wide,
+                                  check_dtype=False, check_names=False)
+
+    office = cube.form_frame('office')
+    pd.testing.assert_frame_equal(office, feasibility_dict['office'],
+                                  check_names=False)
+
+    assert list(cube.drop(['a']).index) == ['b', 'c']
+
+
+def test_cube_max_form_matches_frame(feasibility_dict, parcel_args):
+    forms = ['residential', 'office', 'industrial']
+    dev = develop.Developer(feasibility_dict, forms, 10, **parcel_args)
+    expected = dev.keep_form_with_max_profit(forms)
+
+    cube = FeasibilityCube.from_dict(feasibility_dict)
+    result = cube.max_form(forms)
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+
+def test_lookup_all(low_cost_inputs, parcel_args):
+    pf = sqpf.SqFtProForma.from_defaults()
+    cube = pf.lookup_all(low_cost_inputs)
+    assert cube.forms == pf.forms_to_test
+
+    dev = develop.Developer(cube, ['residential', 'office'], 10,
+                            **parcel_args)
+    bldgs = dev.pick()
+    assert len(bldgs) == 1
+    assert len(dev.feasibility) == 2
+
+    pf.proposals_to_keep = 2
+    with pytest.raises(ValueError):
+        pf.lookup_all(low_cost_inputs)
+
+
+def test_parquet_roundtrip(feasibility_dict, parcel_args, tmpdir):
+    pytest.importorskip('pyarrow')
+    path = str(tmpdir.join('feasibility'))
+    # two parts per form, as written chunk by chunk
+    to_parquet({form: df.iloc[:1] for form, df in feasibility_dict.items()},
+               path, part=0)
+    to_parquet({form: df.iloc[1:] for form, df in feasibility_dict.items()},
+               path, part=1)
+
+    result = read_feasibility(path)
+    assert list(result.keys()) == ['industrial', 'office', 'residential']
+    for form, expected in feasibility_dict.items():
+        df = result[form]
+        assert df.index.name == 'parcel_id'
+        assert list(df.columns) == list(expected.columns)
+        assert df.parking_config.dtype == 'category'
+        pd.testing.assert_frame_equal(
+            df.astype({'parking_config': object}), expected,
+            check_dtype=False, check_names=False)
+
+    # only the requested forms and proposals are read
+    office = read_feasibility(path, forms='office',
+                              filters=[('parcel_id', 'in', ['b'])],
+                              columns=['max_profit'])
+    assert list(office.keys()) == ['office']
+    assert list(office['office'].index) == ['b']
+    assert list(office['office'].columns) == ['max_profit']
+
+    long = read_feasibility(path, forms=['office', 'residential'], long=True)
+    assert len(long) == 5
+    assert set(long.form) == {'office', 'residential'}
+
+    dev = develop.Developer.from_parquet(
+        path, ['residential', 'office'], 10, **parcel_args)
+    assert set(dev.feasibility.columns.get_level_values(0)) == \
+        {'residential', 'office'}
+    assert len(dev.pick(rng=0)) == 1
+
+
+def test_store_matches_cube(low_cost_inputs, parcel_args, tmpdir):
+    pf = sqpf.SqFtProForma.from_defaults()
+    forms = ['residential', 'office', 'industrial']
+    cube = pf.lookup_all(low_cost_inputs, forms)
+    path = str(tmpdir.join('store'))
+    store = pf.lookup_to_store(low_cost_inputs, path, forms, chunk_size=2)
+
+    assert store.complete
+    assert store.shape == cube.shape
+    pd.testing.assert_frame_equal(store.max_form(), cube.max_form())
+    pd.testing.assert_frame_equal(store.max_form(forms[1:], chunk_size=1),
+                                  cube.max_form(forms[1:]))
+    for form in forms:
+        pd.testing.assert_frame_equal(store.form_frame(form),
+                                      cube.form_frame(form))
+
+    view = store.drop(['a']).select_forms(['office'])
+    assert list(view.index) == ['b', 'c']
+    assert view.field('max_profit').shape == (2, 1)
+    pd.testing.assert_frame_equal(view.to_frame(),
+                                  cube.drop(['a']).select_forms(['office'])
+                                  .to_frame())
+
+    bldgs = {}
+    for name, feasibility in [('cube', cube), ('store', store)]:
+        dev = develop.Developer(feasibility, forms, 10, **parcel_args)
+        bldgs[name] = dev.pick(rng=0)
+        assert len(dev.feasibility) == 2
+    pd.testing.assert_frame_equal(bldgs['store'], bldgs['cube'])
+
+
+def test_store_reuse(low_cost_inputs, tmpdir, capsys):
+    pf = sqpf.SqFtProForma.from_defaults()
+    path = str(tmpdir.join('store'))
+    pf.lookup_to_store(low_cost_inputs, path, ['office'])
+    capsys.readouterr()
+
+    store = pf.lookup_to_store(low_cost_inputs, path, ['office'])
+    assert 'Reusing' in capsys.readouterr().out
+    assert isinstance(store, FeasibilityStore)
+
+    # changed parcels invalidate the store
+    changed = low_cost_inputs.assign(office=[20, 20, 20])
+    store = pf.lookup_to_store(changed, path, ['office'])
+    assert 'Reusing' not in capsys.readouterr().out
+    assert store.max_form().max_profit.equals(
+        pf.lookup('office', changed).max_profit)
+
+    # a store built with a modify function is never reused, since the
+    # function may have changed under the same name
+    def modify_revenues(self, form, df, revenues):
+        return revenues * 1.1
+
+    pf.lookup_to_store(low_cost_inputs, path, ['office'],
+                       modify_revenues=modify_revenues)
+    capsys.readouterr()
+
+    def modify_revenues(self, form, df, revenues):
+        return revenues * 1.5
+
+    store = pf.lookup_to_store(low_cost_inputs, path, ['office'],
+                               modify_revenues=modify_revenues)
+    assert 'Reusing' not in capsys.readouterr().out
+    assert store.max_form().max_profit.equals(pf.lookup(
+        'office', low_cost_inputs,
+        modify_revenues=modify_revenues).max_profit)
@@ -0,0 +1,214 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from developer import proposal_select
+
+
+@pytest.fixture
+def proposals():
+    return pd.DataFrame(
+        {'net_units': [1, 1, 1, 5]},
+        index=['a', 'b', 'c', 'd'])
+
+
+def test_weighted_random_choice_distribution(proposals):
+    np.random.seed(0)
+    p = pd.Series([.5, .3, .2, 0], index=proposals.index)
+    first = pd.Series([proposal_select.weighted_random_choice(
+        proposals, p, 1)[0] for _ in range(5000)])
+    freq = first.value_counts(normalize=True)
+    assert 'd' not in freq
+    assert np.allclose(freq[['a', 'b', 'c']].values, [.5, .3, .2],
+                       atol=.03)
+
+
+def test_weighted_random_choice_reaches_target(proposals):
+    p = pd.Series([.25, .25, .25, .25], index=proposals.index)
+    for target in [1, 3, 6, 8]:
+        build_idx = proposal_select.weighted_random_choice(
+            proposals, p, target)
+        units = proposals.net_units.loc[build_idx].values
+        assert units.sum() >= target
+        # the last proposal is the one that meets demand
+        assert units[:-1].sum() < target
+
+    build_idx = proposal_select.weighted_random_choice(proposals, p, 100)
+    assert sorted(build_idx) == ['a', 'b', 'c', 'd']
+    assert len(proposal_select.weighted_random_choice(proposals, p, 0)) == 0
+
+
+@pytest.fixture
+def multi_proposals():
+    return pd.DataFrame(
+        {'parcel_id': ['x', 'x', 'y', 'z', 'z'],
+         'net_units': [1, 2, 1, 3, 4]})
+
+
+def test_weighted_random_choice_multiparcel(multi_proposals):
+    np.random.seed(0)
+    p = pd.Series([.3, .3, .2, .2, 0])
+    for target in [1, 3, 5, 100]:
+        build_idx = proposal_select.weighted_random_choice_multiparcel(
+            multi_proposals, p, target)
+        chosen = multi_proposals.loc[build_idx]
+        assert chosen.parcel_id.is_unique
+        assert 4 not in build_idx
+        if target < 100:
+            assert chosen.net_units.sum() >= target
+            assert chosen.net_units.values[:-1].sum() < target
+        else:
+            assert len(chosen) == 3
+
+    first = pd.Series([multi_proposals.parcel_id[
+        proposal_select.weighted_random_choice_multiparcel(
+            multi_proposals, p, 1)[0]] for _ in range(5000)])
+    freq = first.value_counts(normalize=True)
+    assert np.allclose(freq[['x', 'y', 'z']].values, [.6, .2, .2],
+                       atol=.03)
+
+
+def test_selection_rng(proposals):
+    p = pd.Series([.25, .25, .25, .25], index=proposals.index)
+    draws = [proposal_select.weighted_random_choice(proposals, p, 3, rng=s)
+             for s in [7, 7, np.random.default_rng(7)]]
+    assert list(draws[0]) == list(draws[1]) == list(draws[2])
+
+
+def test_top_profit_choice(proposals, multi_proposals):
+    proposals['max_profit'] = [10., 30., 20., np.nan]
+    build_idx = proposal_select.top_profit_choice(proposals, None, 2)
+    assert list(build_idx) == ['b', 'c']
+    build_idx = proposal_select.top_profit_choice(proposals, None, 100)
+    assert list(build_idx) == ['b', 'c', 'a']
+
+    multi_proposals['max_profit'] = [5., 8., 1., 7., 6.]
+    build_idx = proposal_select.top_profit_choice_multiparcel(
+        multi_proposals, None, 4)
+    assert list(build_idx) == [1, 3]
+    build_idx = proposal_select.top_profit_choice_multiparcel(
+        multi_proposals, None, 100)
+    assert list(build_idx) == [1, 3, 2]
+
+
+def test_proposal_sampler(proposals, multi_proposals):
+    p = pd.Series([.5, .3, .2, 0], index=proposals.index)
+    sampler = proposal_select.ProposalSampler(proposals, p)
+    first = pd.Series([sampler.sample(1, rng=seed)[0]
+                       for seed in range(5000)])
+    freq = first.value_counts(normalize=True)
+    assert 'd' not in freq
+    assert np.allclose(freq[['a', 'b', 'c']].values, [.5, .3, .2],
+                       atol=.03)
+
+    assert sorted(sampler.sample(2, rng=0)) != ['d']
+    assert sorted(sampler.sample(100, rng=0)) == ['a', 'b', 'c']
+    assert len(sampler.sample(0)) == 0
+    assert list(sampler.sample(3, rng=1)) == list(sampler.sample(3, rng=1))
+
+    available = np.array([False, True, True, True])
+    assert sorted(sampler.sample(100, parcel_available=available)) == \
+        ['b', 'c']
+
+    p = pd.Series([.3, .3, .2, .2, 0])
+    sampler = proposal_select.ProposalSampler(multi_proposals, p,
+                                              multiparcel=True)
+    for seed in range(20):
+        build_idx = sampler.sample(100, rng=seed)
+        chosen = multi_proposals.loc[build_idx]
+        assert chosen.parcel_id.is_unique
+        assert len(chosen) == 3
+        assert 4 not in build_idx
+
+
+def test_weighted_random_replicates(proposals, multi_proposals):
+    p = pd.Series([.25, .25, .25, .25], index=proposals.index)
+    selected = proposal_select.weighted_random_replicates(
+        proposals, p, 3, [np.random.default_rng(s) for s in range(20)])
+    assert selected.shape == (20, 4)
+    for s, row in enumerate(selected):
+        expected = proposal_select.weighted_random_choice(proposals, p, 3,
+                                                          rng=s)
+        assert sorted(proposals.index[row]) == sorted(expected)
+
+    p = pd.Series([.3, .3, .2, .2, 0])
+    for target in [3, 100]:
+        selected = proposal_select.weighted_random_replicates(
+            multi_proposals, p, target,
+            [np.random.default_rng(s) for s in range(20)], multiparcel=True)
+        for s, row in enumerate(selected):
+            expected = proposal_select.weighted_random_choice_multiparcel(
+                multi_proposals, p, target, rng=s)
+            assert sorted(np.flatnonzero(row)) == sorted(expected)
+
+    # buffers indexed by parcel code scale with the parcels in df, not
+    # with the parcel codes of the model
+    coded = multi_proposals.assign(
+        parcel_code=np.array([7, 7, 10 ** 9, 3, 3], dtype='int32'))
+    rngs = [np.random.default_rng(s) for s in range(20)]
+    selected = proposal_select.weighted_random_replicates(
+        coded, p, 3, rngs, multiparcel=True)
+    for s, row in enumerate(selected):
+        expected = proposal_select.weighted_random_choice_multiparcel(
+            coded, p, 3, rng=s)
+        assert sorted(np.flatnonzero(row)) == sorted(expected)
+
+
+def test_weighted_random_joint_choice(proposals, multi_proposals):
+    proposals['net_residential_units'] = [1, 0, 2, 0]
+    proposals['net_job_spaces'] = [0, 3, -1, 4]
+    p = pd.Series([.25, .25, .25, .25], index=proposals.index)
+    for seed in range(10):
+        build_idx = proposal_select.weighted_random_joint_choice(
+            proposals, p, 1, 3, rng=seed)
+        chosen = proposals.loc[build_idx]
+        assert chosen.net_residential_units.clip(0).sum() >= 1
+        assert chosen.net_job_spaces.clip(0).sum() >= 3
+        assert len(chosen) == 2 or len(chosen) == 3
+
+    build_idx = proposal_select.weighted_random_joint_choice(
+        proposals, p, 100, 0, rng=0)
+    assert sorted(build_idx) == ['a', 'c']
+
+    multi_proposals['net_residential_units'] = [1, 0, 2, 3, 0]
+    multi_proposals['net_job_spaces'] = [0, 2, 0, 0, 4]
+    p = pd.Series([.2, .2, .2, .2, .2])
+    build_idx = proposal_select.weighted_random_joint_choice(
+        multi_proposals, p, 100, 100, rng=0, multiparcel=True)
+    assert multi_proposals.loc[build_idx].parcel_id.is_unique
+    assert len(build_idx) == 3
+
+
+def test_weighted_random_joint_choice_second_best_proposals():
+    # the best proposal of every parcel is residential-only, so job spaces
+    # can only come from the second-best proposals
+    df = pd.DataFrame({'parcel_id': np.repeat(np.arange(10), 2),
+                       'net_residential_units': [5, 0] * 10,
+                       'net_job_spaces': [0, 10] * 10})
+    p = pd.Series([1e6, 1.] * 10)
+    for seed in range(10):
+        build_idx = proposal_select.weighted_random_joint_choice(
+            df, p, 5, 50, rng=seed, multiparcel=True)
+        chosen = df.loc[build_idx]
+        assert chosen.parcel_id.is_unique
+        assert chosen.net_residential_units.sum() == 5
+        assert chosen.net_job_spaces.sum() == 50
+
+
+def test_priority_index(proposals, multi_proposals):
+    proposals['max_profit'] = [10., 30., 20., np.nan]
+    index = proposal_select.PriorityIndex(proposals)
+    assert len(index) == 3
+    assert list(index.pop(2)) == ['b', 'c']
+    assert list(index.pop(100)) == ['b', 'c', 'a']
+
+    available = np.array([True, False, True, True])
+    assert list(index.pop(1, parcel_available=available)) == ['c']
+    # unavailable proposals at the head are dropped lazily
+    assert len(index) == 2
+    assert len(index.pop(0)) == 0
+
+    multi_proposals['max_profit'] = [5., 8., 1., 7., 6.]
+    index = proposal_select.PriorityIndex(multi_proposals)
+    assert list(index.pop(4, chunk_size=2)) == [1, 3]
+    assert list(index.pop(100, chunk_size=2)) == [1, 3, 2]
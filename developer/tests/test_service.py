@@ -0,0 +1,164 @@
+import asyncio
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from developer import sqftproforma as sqpf
+from developer import service
+
+
+@pytest.fixture
+def parcels():
+    return pd.DataFrame(
+        {'parcel_id': [10, 11, 12, 13],
+         'residential': [40, 40, 40, 60],
+         'office': [15, 18, 15, 20],
+         'retail': [12, 10, 10, 14],
+         'industrial': [12, 12, 12, 12],
+         'land_cost': [1000000, 2000000, 3000000, 500000],
+         'parcel_size': [10000, 20000, 30000, 15000],
+         'max_far': [2.0, 3.0, 0.0, 4.0],
+         'max_height': [40, 60, 80, 90]})
+
+
+def test_registry_config_hash():
+    registry = service.ProFormaRegistry()
+    key = registry.add_defaults()
+    assert registry.add_defaults() == key
+    assert len(registry) == 1
+    assert registry.get() is registry.get(key)
+
+    pf = sqpf.SqFtProForma.from_defaults()
+    pf.profit_factor = 1.2
+    other = registry.add(pf)
+    assert other != key
+    with pytest.raises(KeyError):
+        registry.get()
+
+
+def test_lookup_coalesces_requests(parcels):
+    svc = service.FeasibilityService(batch_window=0.01)
+    svc.registry.add_defaults()
+    pf = svc.registry.get()
+    records = parcels.to_dict('records')
+    requests = [records[:2], records[2:], records[:2]]
+
+    async def run():
+        return await asyncio.gather(
+            *[svc.lookup('residential', r) for r in requests])
+
+    results = asyncio.run(run())
+
+    # one batch for all three requests, the third shares the first's answer
+    assert svc.counters['batches'] == 1
+    assert svc.counters['coalesced'] == 1
+    assert svc.counters['parcels'] == 4
+    assert svc.metrics()['request_latency']['count'] == 3
+    assert results[0] == results[2]
+
+    expected = pf.lookup('residential', parcels.set_index('parcel_id'))
+    for request, result in zip(requests, results):
+        ids = [r['parcel_id'] for r in request]
+        exp = expected[expected.index.isin(ids)]
+        assert [r['parcel_id'] for r in result] == list(exp.index)
+        assert np.allclose([r['max_profit'] for r in result],
+                           exp.max_profit)
+
+
+def test_handle_routes(parcels):
+    svc = service.FeasibilityService(batch_window=0)
+
+    async def run():
+        status, payload = await svc.handle('POST', '/configs',
+                                           {'defaults': True})
+        assert status == 200
+        key = payload['config']
+        status, payload = await svc.handle(
+            'POST', '/lookup',
+            {'config': key, 'form': 'office',
+             'parcels': parcels.drop(columns='parcel_id').to_dict('records')})
+        assert status == 200
+        # without parcel ids, results refer to positions in the request
+        assert all(0 <= r['parcel_id'] < 4 for r in payload['results'])
+        assert (await svc.handle('POST', '/lookup', {'form': 'office'}))[0] \
+            == 400
+        assert (await svc.handle('GET', '/nope'))[0] == 404
+        status, payload = await svc.handle('GET', '/metrics')
+        assert payload['counters']['requests'] == 1
+        # parcel ids must be given for all parcels or none
+        mixed = parcels.to_dict('records')
+        del mixed[0]['parcel_id']
+        assert (await svc.handle('POST', '/lookup', {
+            'form': 'office', 'parcels': mixed}))[0] == 400
+
+    asyncio.run(run())
+
+
+def test_read_request():
+    async def run():
+        reader = asyncio.StreamReader()
+        body = b'{"form": "office"}'
+        reader.feed_data(b'POST /lookup HTTP/1.1\r\nHost: x\r\n'
+                         b'Content-Length: ' + str(len(body)).encode() +
+                         b'\r\n\r\n' + body)
+        reader.feed_eof()
+        return await service.read_request(reader)
+
+    assert asyncio.run(run()) == ('POST', '/lookup', {'form': 'office'})
+
+
+@pytest.mark.parametrize('length', [b'abc', b'-5'])
+def test_read_request_bad_content_length(length):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b'POST /lookup HTTP/1.1\r\nContent-Length: ' +
+                         length + b'\r\n\r\n{}')
+        reader.feed_eof()
+        return await service.read_request(reader)
+
+    assert asyncio.run(run()) is None
+
+
+def test_batch_failure_only_fails_bad_request(parcels):
+    svc = service.FeasibilityService(batch_window=0.01)
+    svc.registry.add_defaults()
+    records = parcels.to_dict('records')
+    bad = [dict(records[0], max_far='not a number')]
+
+    async def run():
+        return await asyncio.gather(
+            svc.lookup('residential', records[:2]),
+            svc.lookup('residential', bad),
+            svc.lookup('residential', records[2:]),
+            return_exceptions=True)
+
+    good, error, other = asyncio.run(run())
+    assert isinstance(error, Exception)
+    assert [r['parcel_id'] for r in good] == [10, 11]
+    assert [r['parcel_id'] for r in other] == [13]
+    assert svc.counters['errors'] == 1
+
+
+def test_handle_unexpected_error(parcels):
+    svc = service.FeasibilityService(batch_window=0)
+    svc.registry.add_defaults()
+
+    def fail(form, df):
+        raise RuntimeError('boom')
+    svc.registry.get().lookup = fail
+
+    status, payload = asyncio.run(svc.handle(
+        'POST', '/lookup',
+        {'form': 'office', 'parcels': parcels.to_dict('records')}))
+    assert status == 500
+    assert 'boom' in payload['error']
+
+
+@pytest.mark.parametrize('body', [None, [], 'office'])
+def test_handle_malformed_body(body):
+    svc = service.FeasibilityService(batch_window=0)
+    for path in ['/configs', '/lookup']:
+        status, payload = asyncio.run(svc.handle('POST', path, body))
+        assert status == 400
+        assert payload == {'error': 'malformed request'}
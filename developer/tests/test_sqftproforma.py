@@ -127,6 +127,22 @@ def test_sqftproforma_keep_n_best(simple_dev_inputs):
         assert len(out) == expected_total_proposals
 
 
+def test_sqftproforma_parcel_labels(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    simple_dev_inputs.index.name = 'parcel_id'
+
+    out = pf.lookup('residential', simple_dev_inputs)
+    assert list(out.index) == ['a', 'b', 'c']
+    assert out.index.name == 'parcel_id'
+
+    pf.proposals_to_keep = 2
+    pf.pass_through = ['max_far']
+    out = pf.lookup('residential', simple_dev_inputs)
+    assert sorted(out.index) == ['a', 'a', 'b', 'b', 'c', 'c']
+    assert out.index.name == 'parcel_id'
+    assert (out.max_far == simple_dev_inputs.max_far[out.index]).all()
+
+
 def test_sqftproforma_max_dua(simple_dev_inputs_low_cost, max_dua_dev_inputs):
     pf = sqpf.SqFtProForma.from_defaults()
 
@@ -242,6 +258,193 @@ def test_roughly_monotonic():
                 assert left < right*1.1
 
 
+def test_lookup_traces(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    simple_dev_inputs.loc['c', 'max_far'] = 0
+    out = pf.lookup('residential', simple_dev_inputs,
+                    trace_parcels=['b', 'c'])
+    expected = pf.lookup('residential', simple_dev_inputs)
+    pd.testing.assert_frame_equal(out, expected)
+
+    info, traces = pf.get_debug_info('residential', 'surface',
+                                     include_traces=True)
+    assert info is pf.get_debug_info('residential', 'surface')
+    assert list(traces.parcel_id.unique()) == ['b', 'c']
+    assert len(traces) == 2 * len(pf.fars)
+
+    b = traces[traces.parcel_id == 'b']
+    assert (b.far_allowed == (b.far <= 3.01)).all()
+
+    # parcel c does not pass the zoning filter
+    c = traces[traces.parcel_id == 'c']
+    assert not c.far_allowed.any()
+    assert c.profit.isnull().all()
+
+    traces = [pf.get_debug_info('residential', config, True)[1]
+              for config in pf.parking_configs]
+    best = pd.concat(traces).set_index('parcel_id').loc['b']
+    best = best.iloc[best.profit.values.argmax()]
+    assert best.far == out.loc['b', 'max_profit_far']
+    assert best.profit == out.loc['b', 'max_profit']
+    assert best.parking_config == out.loc['b', 'parking_config']
+    assert pf.get_debug_info('office', 'deck', True)[1] is None
+
+
+def test_evaluate_matches_lookup(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    simple_dev_inputs.land_cost /= 100
+    simple_dev_inputs.loc['c', 'max_height'] = np.nan
+    batch = pf.evaluate(simple_dev_inputs)
+    assert list(batch.keys()) == pf.forms_to_test
+
+    for form in pf.forms_to_test:
+        expected = pf.lookup(form, simple_dev_inputs)
+        result = batch[form]
+        if len(expected) == 0:
+            assert np.isnan(result['max_profit']).all()
+            continue
+        expected = expected.reindex(simple_dev_inputs.index)
+        assert np.allclose(result['max_profit'], expected.max_profit,
+                           rtol=0, atol=0, equal_nan=True)
+        assert np.allclose(result['max_profit_far'],
+                           expected.max_profit_far, equal_nan=True)
+        assert list(result['parking_config']) == \
+            list(expected.parking_config.where(
+                expected.parking_config.notnull(), None))
+
+        single = pf.evaluate(simple_dev_inputs.loc['b'].to_dict(), form)
+        assert single[form] == {
+            'max_profit': expected.max_profit['b'],
+            'max_profit_far': expected.max_profit_far['b'],
+            'parking_config': expected.parking_config['b']}
+
+    simple_dev_inputs.max_far = 0
+    assert pf.evaluate(simple_dev_inputs.iloc[0]) == {}
+
+
+def test_evaluate_reuses_cached_arrays(simple_dev_inputs, monkeypatch):
+    # after the first call evaluate() must only index cached NumPy arrays,
+    # not rebuild reference columns from the pandas reference tables
+    record = simple_dev_inputs.loc['b'].to_dict()
+    proformas = {'north': sqpf.SqFtProForma.from_defaults(),
+                 'south': sqpf.SqFtProForma.from_defaults()}
+    grouped = sqpf.GroupedProForma(proformas, config_col='region')
+    for pf, rec in [(proformas['north'], record),
+                    (grouped, dict(record, region='south'))]:
+        expected = pf.evaluate(rec)
+
+        def fail(*args):
+            raise AssertionError('reference tables rebuilt')
+        monkeypatch.setattr(pf, '_kernel_params', fail)
+        monkeypatch.setattr(pf, 'reference_dict', None)
+        assert pf.evaluate(rec) == expected
+
+
+def test_estimate_memory():
+    import tracemalloc
+    pf = sqpf.SqFtProForma.from_defaults()
+    df = pd.DataFrame(
+        {'residential': 40., 'office': 18., 'retail': 10., 'industrial': 12.,
+         'land_cost': 10000., 'parcel_size': np.linspace(1e4, 3e4, 20000),
+         'max_far': 4., 'max_height': 80.},
+        index=np.arange(20000))
+
+    tracemalloc.start()
+    pf.lookup('residential', df)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    estimate = pf.estimate_memory(len(df), 'residential')
+    assert peak <= estimate < 2 * peak
+
+    one_form = pf.estimate_memory(2000, 'office')
+    assert pf.estimate_memory(2000) > one_form
+    pf.proposals_to_keep = 3
+    assert pf.estimate_memory(2000, 'office') > one_form
+
+
+def test_grouped_lookup_matches_separate_lookups(simple_dev_inputs):
+    expensive = sqpf.SqFtProForma.get_defaults()
+    expensive['cap_rate'] = .07
+    expensive['costs'] = {use: [c * 1.4 for c in costs]
+                          for use, costs in expensive['costs'].items()}
+    expensive['fars'] = [.5, 1., 2., 3.]
+    proformas = {'north': sqpf.SqFtProForma.from_defaults(),
+                 'south': sqpf.SqFtProForma(**expensive)}
+    for pf in proformas.values():
+        pf.pass_through = ['residential']
+
+    df = pd.concat([simple_dev_inputs, simple_dev_inputs.set_axis(
+        ['d', 'e', 'f'])])
+    df['region'] = ['north', 'south', 'north', 'south', 'north', 'south']
+    grouped = sqpf.GroupedProForma(proformas, config_col='region')
+
+    for form in ['residential', 'office', 'mixedoffice']:
+        result = grouped.lookup(form, df)
+        expected = pd.concat([
+            pf.lookup(form, df[df.region == region])
+            for region, pf in proformas.items()]).loc[result.index]
+        pd.testing.assert_frame_equal(result, expected)
+    assert len(grouped.lookup('residential', df)) == 6
+
+    evaluated = grouped.evaluate(df, 'residential')['residential']
+    result = grouped.lookup('residential', df)
+    rows = df.index.get_indexer(result.index)
+    np.testing.assert_allclose(evaluated['max_profit'][rows],
+                               result.max_profit)
+    assert list(evaluated['parking_config'][rows]) == list(
+        result.parking_config)
+    single = grouped.evaluate(df.loc['b'].to_dict(), 'residential')
+    expected = proformas['south'].evaluate(df.loc['b'].to_dict(),
+                                           'residential')
+    assert single == expected
+    assert 'residential' in single
+
+    df.loc['a', 'region'] = 'east'
+    with pytest.raises(ValueError):
+        grouped.lookup('residential', df)
+    with pytest.raises(ValueError):
+        grouped.evaluate(df, 'residential')
+
+    proformas['south'].only_built = False
+    with pytest.raises(ValueError):
+        sqpf.GroupedProForma(proformas, config_col='region')
+
+
+def test_parcel_parameters(simple_dev_inputs):
+    df = pd.concat([simple_dev_inputs, simple_dev_inputs.set_axis(
+        ['d', 'e', 'f'])])
+    df['cap_rate'] = [.04, .06, np.nan, .06, .04, .05]
+    df['interest_rate'] = [.05, .05, .05, .08, .08, .08]
+    pf = sqpf.SqFtProForma.from_defaults()
+    pf.parcel_parameters = ['cap_rate', 'interest_rate']
+    pf.pass_through = ['residential']
+
+    for form in ['residential', 'office', 'mixedoffice']:
+        result = pf.lookup(form, df)
+        expected = []
+        for (cap_rate, interest_rate), parcels in df.groupby(
+                [df.cap_rate.fillna(pf.cap_rate), df.interest_rate]):
+            scalar_pf = sqpf.SqFtProForma.from_defaults()
+            scalar_pf.cap_rate = cap_rate
+            scalar_pf.interest_rate = interest_rate
+            scalar_pf.pass_through = ['residential']
+            expected.append(scalar_pf.lookup(form, parcels))
+        expected = pd.concat(expected).loc[result.index]
+        pd.testing.assert_frame_equal(result, expected)
+
+        evaluated = pf.evaluate(df, form)[form]
+        np.testing.assert_allclose(
+            evaluated['max_profit'][df.index.get_indexer(result.index)],
+            result.max_profit)
+
+    with pytest.raises(ValueError):
+        pf.lookup('residential', df.drop(columns='cap_rate'))
+    with pytest.raises(AssertionError):
+        sqpf.SqFtProForma(**dict(sqpf.SqFtProForma.get_defaults(),
+                                 parcel_parameters=['fars']))
+
+
 class TestSqFtProFormaDebug(object):
     def teardown_method(self, method):
         if os.path.exists('even_rents.png'):
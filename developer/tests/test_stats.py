@@ -0,0 +1,66 @@
+import pandas as pd
+import pytest
+
+from developer import sqftproforma as sqpf
+from developer import develop
+from developer.stats import Stats, NULL_STATS
+
+
+@pytest.fixture
+def simple_dev_inputs():
+    return pd.DataFrame(
+        {'residential': [40, 40, 40],
+         'office': [15, 18, 15],
+         'retail': [12, 10, 10],
+         'industrial': [12, 12, 12],
+         'land_cost': [1000000, 2000000, 3000000],
+         'parcel_size': [10000, 20000, 30000],
+         'max_far': [2.0, 3.0, 0.0],
+         'max_height': [40, 60, 80]},
+        index=['a', 'b', 'c'])
+
+
+def test_stats_lookup(simple_dev_inputs):
+    records = []
+    stats = Stats(callback=lambda *record: records.append(record))
+    pf = sqpf.SqFtProForma.from_defaults()
+    assert pf.stats is NULL_STATS
+    pf.stats = stats
+
+    def modify_costs(self, form, df, costs):
+        return costs
+
+    pf.lookup('residential', simple_dev_inputs, modify_costs=modify_costs)
+    d = stats.to_dict()
+    assert d['calls']['lookup'] == 1
+    assert d['calls']['lookup.parking_cfg'] == len(pf.parking_configs)
+    assert d['calls']['lookup.modify_costs'] == len(pf.parking_configs)
+    assert d['counts']['lookup.parcels'] == 3
+    # parcel c is not allowed to build by zoning in any parking config
+    assert d['counts']['lookup.zoning_infeasible'] == \
+        len(pf.parking_configs)
+    assert ('count', 'lookup.parcels', 3) in records
+
+    stats.reset()
+    assert stats.to_dict() == NULL_STATS.to_dict()
+
+
+def test_stats_pick(simple_dev_inputs):
+    pf = sqpf.SqFtProForma.from_defaults()
+    feasibility = {'residential': pf.lookup('residential',
+                                            simple_dev_inputs)}
+    stats = Stats()
+    index = simple_dev_inputs.index
+    dev = develop.Developer(feasibility, 'residential', 10,
+                            pd.Series([1000, 2000, 1000], index=index),
+                            pd.Series([650, 650, 650], index=index),
+                            pd.Series([0, 0, 1000], index=index),
+                            max_parcel_size=1500, stats=stats)
+    dev.pick()
+    d = stats.to_dict()
+    assert d['counts']['pick.candidates'] == 2
+    assert d['counts']['pick.max_parcel_size'] == 1
+    assert d['counts']['pick.built'] == 1
+    for stage in ['pick.candidates', 'pick.filters', 'pick.probabilities',
+                  'pick.select', 'pick.drop_built']:
+        assert d['calls'][stage] == 1
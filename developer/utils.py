@@ -124,3 +124,68 @@ def columnize(iterable):
 
     column = np.reshape(iterable, (-1, 1))
     return column
+
+
+def seed_sequence(seed=None):
+    """
+    Turn a seed into a numpy SeedSequence, from which independent random
+    streams can be spawned.
+
+    Parameters
+    ----------
+    seed : None, int, SeedSequence or Generator
+        If None, the seed is drawn from NumPy's global random state, so that
+        ``np.random.seed`` still makes runs reproducible.  If a Generator,
+        the seed is drawn from that generator.
+
+    Returns
+    -------
+    SeedSequence
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    if isinstance(seed, np.random.Generator):
+        return np.random.SeedSequence(seed.integers(2 ** 63, size=4))
+    if seed is None:
+        seed = np.random.randint(np.iinfo(np.int32).max)
+    return np.random.SeedSequence(seed)
+
+
+def get_rng(seed=None):
+    """
+    Return a numpy random Generator.
+
+    Parameters
+    ----------
+    seed : None, int, SeedSequence or Generator
+        A Generator is returned as is; anything else is passed through
+        seed_sequence().
+
+    Returns
+    -------
+    Generator
+    """
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return np.random.default_rng(seed_sequence(seed))
+
+
+def spawn_rngs(seed, n):
+    """
+    Spawn independent random Generators, one per sub-problem.  The i-th
+    Generator only depends on the seed and on i, so sub-problems give the
+    same results whether they run serially or concurrently, and any one of
+    them can be re-run on its own.
+
+    Parameters
+    ----------
+    seed : None, int, SeedSequence or Generator
+        See seed_sequence()
+    n : int
+        Number of Generators to spawn
+
+    Returns
+    -------
+    list of Generator
+    """
+    return [np.random.default_rng(s) for s in seed_sequence(seed).spawn(n)]
@@ -16,17 +16,27 @@ setup(
     license='BSD',
     url='https://github.com/udst/developer',
     classifiers=[
-        'Programming Language :: Python :: 2.7',
-        'Programming Language :: Python :: 3.5'
+        'Programming Language :: Python :: 3',
+        'Programming Language :: Python :: 3.9',
+        'Programming Language :: Python :: 3.10',
+        'Programming Language :: Python :: 3.11',
+        'Programming Language :: Python :: 3.12'
     ],
-    packages=find_packages(exclude=['*.tests']),
+    python_requires='>=3.9',
+    packages=find_packages(exclude=['*.tests', 'benchmarks']),
     install_requires=[
-        'numpy >= 1.1.0',
-        'pandas >= 0.16.0',
+        'numpy >= 1.17.0',
+        'pandas >= 2.0.0',
         'orca >= 1.3.0',
         'urbansim >= 0.1.1',
     ],
     extras_require={
-        'pandana': ['pandana>=0.1']
+        'pandana': ['pandana>=0.1'],
+        'parquet': ['pyarrow>=10.0']
+    },
+    entry_points={
+        'console_scripts': [
+            'developer-feasibility = developer.cli:main',
+        ]
     }
 )